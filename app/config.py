@@ -13,6 +13,11 @@ DATABASE_URL_ALEMBIC: str = os.getenv("DATABASE_URL_ALEMBIC", f"postgresql+psyco
 CREDENTIALS_FILE: Path = Path(os.getenv("CREDENTIALS_FILE", BASE_DIR / "credentials.json"))
 ADMIN_API_KEY: str = os.getenv("ADMIN_API_KEY", "change_me_to_a_secure_key")
 
+# Gmail accounts to sync, comma separated ids. Each one has its own OAuth token and SyncState row.
+# The first one is the default for endpoints and scripts called without an account.
+GMAIL_ACCOUNTS = [a.strip() for a in os.getenv("GMAIL_ACCOUNTS", "gmail").split(",") if a.strip()]
+DEFAULT_GMAIL_ACCOUNT = GMAIL_ACCOUNTS[0]
+
 GMAIL_SCOPES = ["https://www.googleapis.com/auth/gmail.modify",
                  "https://www.googleapis.com/auth/gmail.labels",]
 
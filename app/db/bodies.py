@@ -0,0 +1,26 @@
+import hashlib
+import zlib
+
+# zlib level 6 is the usual speed / ratio tradeoff
+COMPRESSION_LEVEL = 6
+
+
+def body_row(text):
+    """
+    Build an email_bodies row for a body text, None for empty bodies.
+    """
+    if not text:
+        return None
+    raw = text.encode("utf-8")
+    return {
+        "hash": hashlib.sha256(raw).hexdigest(),
+        "data": zlib.compress(raw, COMPRESSION_LEVEL),
+        "size": len(text),
+    }
+
+
+def decompress_body(data):
+    if data is None:
+        return None
+    return zlib.decompress(data).decode("utf-8")
+
@@ -0,0 +1,98 @@
+import logging
+import os
+
+from sqlalchemy import column, select, table, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+# Batches with at least this many rows are loaded via COPY into a staging table
+BULK_COPY_THRESHOLD = int(os.getenv("BULK_COPY_THRESHOLD", "1000"))
+
+# asyncpg allows at most 32767 bind parameters per statement
+MAX_BIND_PARAMS = 32767
+
+
+def _dedupe(rows, index_elements):
+    """
+    Keep the last row per conflict key.
+    Postgres refuses to update the same row twice within one INSERT ... ON CONFLICT.
+    """
+    unique = {}
+    for row in rows:
+        unique[tuple(row[c] for c in index_elements)] = row
+    return list(unique.values())
+
+
+def _on_conflict(stmt, index_elements, update_columns):
+    if update_columns:
+        return stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={c: stmt.excluded[c] for c in update_columns},
+        )
+    return stmt.on_conflict_do_nothing(index_elements=index_elements)
+
+
+async def _values_upsert(db: AsyncSession, target, rows, columns, index_elements, update_columns):
+    chunk_size = max(1, MAX_BIND_PARAMS // len(columns))
+    for start in range(0, len(rows), chunk_size):
+        stmt = insert(target).values(rows[start:start + chunk_size])
+        await db.execute(_on_conflict(stmt, index_elements, update_columns))
+
+
+async def _copy_upsert(db: AsyncSession, target, rows, columns, index_elements, update_columns):
+    staging_name = f"_staging_{target.name}"
+    staging = table(staging_name, *(column(c) for c in columns))
+
+    # temp tables live on the session's connection and inside its transaction
+    await db.execute(text(
+        f"CREATE TEMP TABLE {staging_name} (LIKE {target.name} INCLUDING DEFAULTS) ON COMMIT DROP"
+    ))
+
+    conn = await db.connection()
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        staging_name,
+        records=[tuple(row[c] for c in columns) for row in rows],
+        columns=columns,
+    )
+
+    stmt = insert(target).from_select(columns, select(*(staging.c[c] for c in columns)))
+    await db.execute(_on_conflict(stmt, index_elements, update_columns))
+    await db.execute(text(f"DROP TABLE {staging_name}"))
+
+
+async def bulk_upsert(
+    db: AsyncSession,
+    target,
+    rows: list[dict],
+    *,
+    index_elements: list[str],
+    update_columns: list[str] | None = None,
+):
+    """
+    # Write many rows with as few round trips as possible
+
+    Large batches are COPY'd into a staging table and merged with a single
+    INSERT ... SELECT ... ON CONFLICT, small batches use one multi-row INSERT.
+
+    :param db: database session, the caller commits
+    :type db: AsyncSession
+    :param target: Table to write into (e.g. ``Email.__table__``)
+    :param rows: rows as dicts, all with the same keys
+    :param index_elements: columns of the conflict target
+    :param update_columns: columns to overwrite on conflict, None means DO NOTHING
+    """
+    if not rows:
+        return
+
+    rows = _dedupe(rows, index_elements)
+    columns = list(rows[0].keys())
+
+    if len(rows) >= BULK_COPY_THRESHOLD:
+        await _copy_upsert(db, target, rows, columns, index_elements, update_columns)
+    else:
+        await _values_upsert(db, target, rows, columns, index_elements, update_columns)
+
+    logger.debug("Bulk upserted rows=%s table=%s", len(rows), target.name)
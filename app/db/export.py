@@ -0,0 +1,81 @@
+import os
+from datetime import datetime
+
+from sqlalchemy import select, tuple_
+
+from app.db.labels import email_label_names
+from app.db.session import AsyncSessionLocal
+from app.db.utils import stream_chunks
+from app.models.email import Email
+from app.models.email_body import EmailBody
+
+# Rows per keyset page, every page runs in its own short transaction
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "10000"))
+# Rows fetched per round trip from the server-side cursor of a page
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "500"))
+
+
+def _export_stmt(with_body: bool, account_id: str | None, since: datetime | None, until: datetime | None):
+    columns = [
+        Email.id, Email.account_id, Email.thread_id, Email.from_address, Email.to_address,
+        Email.subject, Email.date_sent, email_label_names().label("labels"),
+    ]
+    stmt = select(*columns)
+    if with_body:
+        stmt = stmt.add_columns(EmailBody.data.label("body")).outerjoin(EmailBody, Email.body_hash == EmailBody.hash)
+    if account_id is not None:
+        stmt = stmt.where(Email.account_id == account_id)
+    if since is not None:
+        stmt = stmt.where(Email.date_sent >= since)
+    if until is not None:
+        stmt = stmt.where(Email.date_sent < until)
+    return stmt
+
+
+async def _stream_page(stmt):
+    async with AsyncSessionLocal() as db:
+        async for chunk in stream_chunks(db, stmt.limit(EXPORT_PAGE_SIZE), EXPORT_CHUNK_SIZE):
+            yield chunk
+
+
+async def iter_email_chunks(
+    with_body: bool = False,
+    account_id: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+):
+    """
+    Yield all matching emails in chunks of at most EXPORT_CHUNK_SIZE rows, ordered by (date_sent, id).
+    Pages of EXPORT_PAGE_SIZE rows are read with a server-side cursor and continue after the
+    last row of the previous page, so memory stays constant and no snapshot is held for the
+    whole export. Emails without date_sent come first, ordered by id.
+
+    :param with_body: add the compressed body as column "body", see app.db.bodies.decompress_body
+    """
+    stmt = _export_stmt(with_body, account_id, since, until)
+
+    # a NULL date_sent never compares in the (date_sent, id) keyset, so these go first by id
+    if since is None and until is None:
+        undated = stmt.where(Email.date_sent.is_(None)).order_by(Email.id)
+        last_id = None
+        while True:
+            page = undated if last_id is None else undated.where(Email.id > last_id)
+            rows = 0
+            async for chunk in _stream_page(page):
+                rows += len(chunk)
+                last_id = chunk[-1].id
+                yield chunk
+            if rows < EXPORT_PAGE_SIZE:
+                break
+
+    dated = stmt.where(Email.date_sent.isnot(None)).order_by(Email.date_sent, Email.id)
+    last = None
+    while True:
+        page = dated if last is None else dated.where(tuple_(Email.date_sent, Email.id) > tuple_(*last))
+        rows = 0
+        async for chunk in _stream_page(page):
+            rows += len(chunk)
+            last = (chunk[-1].date_sent, chunk[-1].id)
+            yield chunk
+        if rows < EXPORT_PAGE_SIZE:
+            break
@@ -0,0 +1,117 @@
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import array_agg, insert
+
+from app.db.bulk import bulk_upsert
+from app.db.session import AsyncSessionLocal
+from app.db.utils import commit_or_rollback
+from app.ml.config import SEMANTIC_LABELS
+from app.models.email import Email
+from app.models.label import EmailLabel, LabelName
+
+# label name -> label_names.id, dictionary rows are never deleted so entries stay valid
+_label_ids = {}
+
+
+async def label_ids(names) -> dict[str, int]:
+    """
+    Map label names to their label_names ids, adding unknown names to the dictionary.
+
+    New names are committed in their own transaction right away, so a caller
+    rolling back never leaves ids in the cache that do not exist.
+    """
+    names = set(names)
+    missing = names - _label_ids.keys()
+    if missing:
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                insert(LabelName)
+                .values([{"name": name} for name in sorted(missing)])
+                .on_conflict_do_nothing(index_elements=["name"])
+            )
+            result = await db.execute(select(LabelName.name, LabelName.id).where(LabelName.name.in_(missing)))
+            _label_ids.update(result.tuples().all())
+            await commit_or_rollback(db, context={"action": "add_label_names", "labels": len(missing)})
+    return {name: _label_ids[name] for name in names}
+
+
+async def stored_label_ids(db, email_ids) -> dict[str, set[int]]:
+    """
+    Current label ids per stored email, emails without labels map to an empty set, unknown ids are left out.
+    """
+    result = await db.execute(
+        select(Email.id, EmailLabel.label_id)
+        .outerjoin(EmailLabel, EmailLabel.email_id == Email.id)
+        .where(Email.id.in_(email_ids))
+    )
+    stored = {}
+    for email_id, label_id in result.tuples().all():
+        labels = stored.setdefault(email_id, set())
+        if label_id is not None:
+            labels.add(label_id)
+    return stored
+
+
+async def replace_label_sets(db, label_sets: dict[str, set[int]], stored: dict[str, set[int]] | None = None) -> list[str]:
+    """
+    Make the email_labels rows of stored emails equal label_sets, the caller commits.
+    Only emails whose label set differs are rewritten, emails that are not stored are ignored.
+    labels_changed_at is only bumped when the SEMANTIC_LABELS of an email change, reading or
+    starring mail must not make the online model learn it again.
+
+    :param label_sets: email id -> label_names ids
+    :param stored: result of stored_label_ids for these emails, if the caller already has it
+    :return: ids of the rewritten emails
+    """
+    if stored is None:
+        stored = await stored_label_ids(db, label_sets.keys())
+    changed = [email_id for email_id, label_set in stored.items() if label_set != label_sets[email_id]]
+    if not changed:
+        return []
+
+    trainable = set(
+        (await db.execute(select(LabelName.id).where(LabelName.name.in_(SEMANTIC_LABELS)))).scalars().all()
+    )
+    relabeled = [
+        email_id for email_id in changed if stored[email_id] & trainable != label_sets[email_id] & trainable
+    ]
+
+    await db.execute(delete(EmailLabel).where(EmailLabel.email_id.in_(changed)))
+    if relabeled:
+        await db.execute(update(Email).where(Email.id.in_(relabeled)).values(labels_changed_at=func.now()))
+    await bulk_upsert(
+        db,
+        EmailLabel.__table__,
+        [{"email_id": email_id, "label_id": label_id} for email_id in changed for label_id in label_sets[email_id]],
+        index_elements=["email_id", "label_id"],
+    )
+    return changed
+
+
+def group_label_ids(email_ids, rows) -> dict[str, set[int]]:
+    """
+    Group email_labels rows by email, every one of email_ids gets an entry, also without labels.
+    """
+    sets = {email_id: set() for email_id in email_ids}
+    for row in rows:
+        sets[row["email_id"]].add(row["label_id"])
+    return sets
+
+
+def junction_rows(label_rows, ids):
+    """
+    Turn {"email_id", "name"} rows into email_labels rows.
+    """
+    return [{"email_id": row["email_id"], "label_id": ids[row["name"]]} for row in label_rows]
+
+
+def email_label_names():
+    """
+    Correlated subquery with the label names of the selected email as an array, NULL without labels.
+    """
+    return (
+        select(array_agg(LabelName.name))
+        .select_from(EmailLabel)
+        .join(LabelName, LabelName.id == EmailLabel.label_id)
+        .where(EmailLabel.email_id == Email.id)
+        .scalar_subquery()
+    )
@@ -0,0 +1,59 @@
+import logging
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.db.session import engine
+
+logger = logging.getLogger(__name__)
+
+
+class AdvisoryLock:
+    """
+    Postgres session-level advisory lock, held on a dedicated connection.
+
+    The server releases it as soon as that connection ends, so a killed process
+    never leaves a stale lock behind. Being server side, it also excludes
+    holders in other processes and app replicas.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._conn: AsyncConnection | None = None
+
+    def _key(self):
+        return func.hashtext(self.name)
+
+    async def acquire(self) -> bool:
+        """
+        Try to take the lock without waiting, False if someone else holds it.
+        """
+        conn = await engine.connect()
+        try:
+            acquired = (await conn.execute(select(func.pg_try_advisory_lock(self._key())))).scalar()
+            # the lock belongs to the connection, not to this implicit transaction
+            await conn.commit()
+        except BaseException:
+            await conn.close()
+            raise
+
+        if not acquired:
+            await conn.close()
+            return False
+        self._conn = conn
+        return True
+
+    async def release(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        try:
+            await conn.execute(select(func.pg_advisory_unlock(self._key())))
+            await conn.commit()
+        except BaseException:
+            # never hand a connection that may still hold the lock back to the pool
+            logger.warning("Failed to unlock %r, discarding its connection", self.name, exc_info=True)
+            await conn.invalidate()
+            raise
+        finally:
+            await conn.close()
@@ -4,10 +4,13 @@ from sqlalchemy import text
 
 async def reset_email_tables(session: AsyncSession) -> None:
     """
-    Deletes all data from sync_state, labels, emails.
-    FK order respected.
+    Deletes all data from backfill_windows, sync_state, predictions, email_labels, emails, email_bodies.
+    FK order respected. The label_names dictionary is kept, running processes cache its ids.
     This is really just a convenience function for tests and development.
     """
+    await session.execute(text("DELETE FROM backfill_windows"))
     await session.execute(text("DELETE FROM sync_state"))
-    await session.execute(text("DELETE FROM labels"))
+    await session.execute(text("DELETE FROM predictions"))
+    await session.execute(text("DELETE FROM email_labels"))
     await session.execute(text("DELETE FROM emails"))
+    await session.execute(text("DELETE FROM email_bodies"))
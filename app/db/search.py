@@ -0,0 +1,60 @@
+import os
+from functools import reduce
+
+from sqlalchemy import String, bindparam, func, literal_column, update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.email import Email
+
+# Text search configurations, the same languages as app.ml.utils.get_stopwords
+SEARCH_CONFIGS = ("english", "german")
+# Body text indexed per email, tsvector positions end at 16383 anyway
+SEARCH_BODY_CHARS = int(os.getenv("SEARCH_BODY_CHARS", "20000"))
+
+
+def _regconfig(config: str):
+    # a literal, so the planner matches the function signature without a bind parameter type
+    return literal_column(f"'{config}'::regconfig")
+
+
+def document(subject, body):
+    """
+    tsvector over subject (weight A) and body (weight B) in every SEARCH_CONFIGS language.
+    """
+    parts = [
+        func.setweight(func.to_tsvector(_regconfig(config), func.coalesce(text, "")), literal_column(f"'{weight}'"))
+        for config in SEARCH_CONFIGS
+        for text, weight in ((subject, "A"), (body, "B"))
+    ]
+    return reduce(lambda a, b: a.op("||")(b), parts)
+
+
+def search_query(q: str):
+    """
+    Web search syntax ("quoted phrase", -excluded, or) matching in any SEARCH_CONFIGS language.
+    """
+    queries = [func.websearch_to_tsquery(_regconfig(config), q) for config in SEARCH_CONFIGS]
+    return reduce(lambda a, b: a.op("||")(b), queries)
+
+
+async def update_search_vectors(db: AsyncSession, rows):
+    """
+    Set emails.search_vector with one statement, the caller commits.
+    The body is only stored compressed, so the text is sent along here.
+
+    :param rows: {"id", "subject", "body"} dicts of emails already written
+    """
+    if not rows:
+        return
+    values = func.unnest(
+        bindparam("ids", [r["id"] for r in rows], type_=ARRAY(String)),
+        bindparam("subjects", [r["subject"] for r in rows], type_=ARRAY(String)),
+        bindparam("bodies", [r["body"] for r in rows], type_=ARRAY(String)),
+    ).table_valued("id", "subject", "body").render_derived()
+    await db.execute(
+        update(Email)
+        .where(Email.id == values.c.id)
+        .values(search_vector=document(values.c.subject, values.c.body))
+        .execution_options(synchronize_session=False)
+    )
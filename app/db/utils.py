@@ -1,6 +1,9 @@
 import logging
+import time
 from sqlalchemy.exc import SQLAlchemyError
 
+from app.metrics import DB_COMMIT_SECONDS, DB_COMMITS
+
 logger = logging.getLogger(__name__)
 
 
@@ -13,9 +16,13 @@ async def commit_or_rollback(db, *, context: dict):
     :param context: context for logging
     :type context: dict
     """
+    action = context.get("action", "unknown")
+    started = time.monotonic()
     try:
         await db.commit()
+        DB_COMMITS.labels(action, "ok").inc()
     except SQLAlchemyError:
+        DB_COMMITS.labels(action, "rollback").inc()
         await db.rollback()
         logger.error(
             "DB transaction rolled back",
@@ -23,3 +30,18 @@ async def commit_or_rollback(db, *, context: dict):
             extra=context,
         )
         raise
+    finally:
+        DB_COMMIT_SECONDS.labels(action).observe(time.monotonic() - started)
+
+
+async def stream_chunks(db, stmt, chunk_size: int):
+    """
+    Run stmt on a server-side cursor and yield its rows in lists of at most chunk_size,
+    so only one chunk of the result is held in memory.
+
+    :param db: database session, the cursor lives in its current transaction
+    :type db: AsyncSession
+    """
+    result = await db.stream(stmt.execution_options(yield_per=chunk_size))
+    async for chunk in result.partitions():
+        yield chunk
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, select, update
+
+from app.db.session import AsyncSessionLocal
+from app.db.utils import commit_or_rollback
+from app.gmail.fetch import gmail_call
+from app.gmail.pipeline import SyncPipeline, submit_page
+from app.models.backfill_window import BackfillWindow
+from app.models.sync_state import SyncState
+
+logger = logging.getLogger(__name__)
+
+# Use the date-partitioned backfill instead of the sequential listing for full syncs
+GMAIL_BACKFILL = os.getenv("GMAIL_BACKFILL", "false").lower() in ("1", "true", "yes")
+GMAIL_BACKFILL_WORKERS = int(os.getenv("GMAIL_BACKFILL_WORKERS", "4"))
+GMAIL_BACKFILL_WINDOW_DAYS = int(os.getenv("GMAIL_BACKFILL_WINDOW_DAYS", "30"))
+# Gmail launched 2004-04-01, nothing older can be in a mailbox
+GMAIL_BACKFILL_SINCE = datetime.fromisoformat(os.getenv("GMAIL_BACKFILL_SINCE", "2004-04-01")).replace(
+    tzinfo=timezone.utc
+)
+
+
+def window_query(window: BackfillWindow) -> str:
+    # epoch seconds are exact, date operators would be evaluated in PST.
+    # after: starts one second early so a message on the boundary is never lost
+    return f"after:{int(window.after.timestamp()) - 1} before:{int(window.before.timestamp())}"
+
+
+async def has_open_windows(sync_state_id: str) -> bool:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(BackfillWindow.id)
+            .where(BackfillWindow.sync_state_id == sync_state_id)
+            .where(BackfillWindow.status != "done")
+            .limit(1)
+        )
+        return result.first() is not None
+
+
+async def plan_windows(sync_state_id: str):
+    """
+    Return the windows still to do, newest first.
+    Creates them on the first run, later runs pick up pending and failed ones.
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(BackfillWindow).where(BackfillWindow.sync_state_id == sync_state_id)
+        )
+        windows = result.scalars().all()
+
+        if not windows:
+            step = timedelta(days=GMAIL_BACKFILL_WINDOW_DAYS)
+            before = datetime.now(timezone.utc) + timedelta(days=1)
+            while before > GMAIL_BACKFILL_SINCE:
+                after = max(before - step, GMAIL_BACKFILL_SINCE)
+                windows.append(BackfillWindow(
+                    sync_state_id=sync_state_id, after=after, before=before, status="pending", listed=0
+                ))
+                before = after
+            db.add_all(windows)
+            await commit_or_rollback(
+                db,
+                context={"sync_state_id": sync_state_id, "action": "plan_backfill", "windows": len(windows)},
+            )
+            logger.info("Planned backfill windows=%s", len(windows))
+
+    open_windows = [w for w in windows if w.status != "done"]
+    return sorted(open_windows, key=lambda w: w.before, reverse=True)
+
+
+async def _mark_window_failed(window: BackfillWindow, error: Exception):
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(BackfillWindow)
+            .where(BackfillWindow.id == window.id)
+            .values(status="failed", last_error=str(error))
+        )
+        await commit_or_rollback(
+            db,
+            context={"sync_state_id": window.sync_state_id, "action": "backfill_window_failed", "window": window.id},
+        )
+
+
+async def backfill_window(pipeline: SyncPipeline, window: BackfillWindow, refresh_known_labels: bool = False):
+    """
+    List one window and submit its pages. Each page checkpoints the window's
+    own page token, the last one marks it done.
+    """
+    query = window_query(window)
+    next_page_token = window.page_token
+    listed = window.listed or 0
+    logger.debug("Backfill window id=%s query=%r", window.id, query)
+
+    while True:
+        response = await gmail_call(
+            lambda client: client.list_messages(page_token=next_page_token, query=query),
+            "messages.list",
+            account_id=window.sync_state_id,
+        )
+
+        msg_ids = [m["id"] for m in response.get("messages", [])]
+        listed += len(msg_ids)
+        next_page_token = response.get("nextPageToken")
+
+        values = {"listed": listed, "last_error": None}
+        if next_page_token:
+            values["page_token"] = next_page_token
+        else:
+            values["status"] = "done"
+            values["finished_at"] = datetime.now(timezone.utc)
+        checkpoint = update(BackfillWindow).where(BackfillWindow.id == window.id).values(**values)
+        await submit_page(pipeline, msg_ids, checkpoint, refresh_known_labels)
+
+        if not next_page_token:
+            break
+
+
+async def backfill_gmail(label_map, state: SyncState, refresh_known_labels: bool = False):
+    """
+    Full sync split into date windows that are listed concurrently, newest first,
+    so recent mail is usable early. All windows feed the same sync pipeline.
+
+    A failing window is recorded and skipped, it is retried by the next run.
+    Raises RuntimeError if any window failed, so the sync does not switch to incremental.
+    """
+    windows = await plan_windows(state.id)
+    logger.info("Backfill started windows=%s workers=%s", len(windows), GMAIL_BACKFILL_WORKERS)
+
+    todo = asyncio.Queue()
+    for window in windows:
+        todo.put_nowait(window)
+    failed = []
+
+    async def window_worker(pipeline: SyncPipeline):
+        while not todo.empty():
+            window = todo.get_nowait()
+            try:
+                await backfill_window(pipeline, window, refresh_known_labels)
+            except Exception as e:
+                logger.exception("Backfill window id=%s failed", window.id)
+                failed.append(window)
+                await _mark_window_failed(window, e)
+
+    async def produce(pipeline: SyncPipeline):
+        await asyncio.gather(*(window_worker(pipeline) for _ in range(GMAIL_BACKFILL_WORKERS)))
+
+    await SyncPipeline(label_map, state.id).run(produce)
+
+    if failed:
+        raise RuntimeError(f"Backfill incomplete, {len(failed)} windows failed and will be retried")
+
+    # all windows done, the next backfill plans from scratch
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(BackfillWindow).where(BackfillWindow.sync_state_id == state.id))
+        await commit_or_rollback(
+            db,
+            context={"sync_state_id": state.id, "action": "finish_backfill"},
+        )
+    logger.info("Backfill finished")
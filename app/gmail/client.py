@@ -7,23 +7,61 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 
-from app.config import CREDENTIALS_FILE, GMAIL_SCOPES
+from app.config import CREDENTIALS_FILE, DEFAULT_GMAIL_ACCOUNT, GMAIL_SCOPES
 
 logger = logging.getLogger(__name__)
 
+# Gmail accepts at most 100 sub-requests per batch HTTP call
+MAX_BATCH_SIZE = 100
+
+# Partial responses: only request what the sync pipeline reads
+_PART_FIELDS = "mimeType,filename,headers(name,value),body(data,attachmentId)"
+MESSAGE_FIELDS = {
+    "minimal": "id,threadId,labelIds",
+    "metadata": "id,threadId,labelIds,payload/headers",
+    "full": (
+        f"id,threadId,labelIds,"
+        f"payload({_PART_FIELDS},parts({_PART_FIELDS},parts({_PART_FIELDS},parts)))"
+    ),
+}
+METADATA_HEADERS = ["From", "To", "Subject", "Date"]
+LIST_MESSAGES_FIELDS = "messages/id,nextPageToken"
+HISTORY_FIELDS = (
+    "history(messagesAdded/message/id,messagesDeleted/message/id,"
+    "labelsAdded/message(id,labelIds),labelsRemoved/message(id,labelIds)),"
+    "historyId,nextPageToken"
+)
+
+
+def token_file_for(directory: Path, account_id: str) -> Path:
+    """
+    OAuth token of an account: token.json for the original single account "gmail",
+    token_<account_id>.json for every other one.
+    """
+    if account_id == "gmail":
+        return directory / "token.json"
+    return directory / f"token_{account_id}.json"
+
 
 class GmailClient:
     """
     Gmail client with automatic OAuth flow, token persistence, and refresh.
+    All accounts share the OAuth client secrets, each one has its own token file.
     """
 
-    def __init__(self, client_secrets_path: Optional[Path] = None, scopes: Optional[List[str]] = None):
+    def __init__(
+        self,
+        client_secrets_path: Optional[Path] = None,
+        scopes: Optional[List[str]] = None,
+        account_id: str = DEFAULT_GMAIL_ACCOUNT,
+    ):
+        self.account_id = account_id
         self.scopes = scopes or GMAIL_SCOPES
         self.client_secrets_path = Path(client_secrets_path) if client_secrets_path else CREDENTIALS_FILE
-        self.token_file = self.client_secrets_path.parent / "token.json"
+        self.token_file = token_file_for(self.client_secrets_path.parent, account_id)
         self.creds = self._load_credentials()
         self.service = build("gmail", "v1", credentials=self.creds, cache_discovery=False)
-        logger.info("Gmail client initialized")
+        logger.info("Gmail client initialized account=%s", account_id)
 
     def _load_credentials(self) -> Credentials:
         creds = None
@@ -38,7 +76,7 @@ class GmailClient:
 
         # 2. If missing/invalid, run OAuth flow
         if not creds or not creds.valid:
-            logger.info("Running OAuth flow to authorize Gmail access...")
+            logger.info("Running OAuth flow to authorize Gmail access for account=%s...", self.account_id)
             flow = InstalledAppFlow.from_client_secrets_file(self.client_secrets_path, self.scopes)
             creds = flow.run_local_server(port=0)
             self.token_file.parent.mkdir(parents=True, exist_ok=True)
@@ -54,19 +92,76 @@ class GmailClient:
         return creds
 
     # Gmail API helpers
-    def list_messages(self, user_id="me", label_ids=None, page_token=None):
+    def get_profile(self, user_id="me"):
+        return self.service.users().getProfile(userId=user_id).execute()
+
+    def list_messages(self, user_id="me", label_ids=None, page_token=None, query=None, fields=LIST_MESSAGES_FIELDS):
         return self.service.users().messages().list(
-            userId=user_id, labelIds=label_ids, pageToken=page_token
+            userId=user_id, labelIds=label_ids, pageToken=page_token, q=query, fields=fields
         ).execute()
 
-    def get_message(self, msg_id, user_id="me"):
-        return self.service.users().messages().get(userId=user_id, id=msg_id, format="full").execute()
+    def _message_request(self, msg_id, user_id, format, fields):
+        """
+        Build a messages.get request for format minimal / metadata / full.
+        fields defaults to the trimmed mask of MESSAGE_FIELDS, pass "*" for the complete resource.
+        """
+        params = {
+            "userId": user_id,
+            "id": msg_id,
+            "format": format,
+            "fields": fields or MESSAGE_FIELDS[format],
+        }
+        if format == "metadata":
+            params["metadataHeaders"] = METADATA_HEADERS
+        return self.service.users().messages().get(**params)
+
+    def get_message(self, msg_id, user_id="me", format="full", fields=None):
+        return self._message_request(msg_id, user_id, format, fields).execute()
+
+    def get_messages_batch(self, msg_ids, user_id="me", format="full", fields=None):
+        """
+        Fetch several messages via the Gmail batch endpoint, one HTTP call per MAX_BATCH_SIZE ids.
+
+        Returns a tuple (messages, errors): messages maps msg_id -> message resource,
+        errors maps msg_id -> exception for sub-requests that failed.
+        """
+        messages = {}
+        errors = {}
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                errors[request_id] = exception
+            else:
+                messages[request_id] = response
+
+        # request_id has to be unique within a batch
+        unique_ids = list(dict.fromkeys(msg_ids))
+        for start in range(0, len(unique_ids), MAX_BATCH_SIZE):
+            batch = self.service.new_batch_http_request(callback=callback)
+            for msg_id in unique_ids[start:start + MAX_BATCH_SIZE]:
+                batch.add(
+                    self._message_request(msg_id, user_id, format, fields),
+                    request_id=msg_id,
+                )
+            batch.execute()
+
+        return messages, errors
+
+    def watch(self, topic_name, user_id="me", label_ids=None):
+        """
+        Ask Gmail to publish mailbox changes to a Pub/Sub topic. Expires after 7 days.
+        """
+        body = {"topicName": topic_name}
+        if label_ids:
+            body["labelIds"] = label_ids
+        return self.service.users().watch(userId=user_id, body=body).execute()
 
     def list_labels(self, user_id="me"):
         result = self.service.users().labels().list(userId=user_id).execute()
         return result.get("labels", [])
 
-    def get_history(self, start_history_id, user_id="me", label_ids=None):
+    def get_history(self, start_history_id, user_id="me", label_ids=None, page_token=None, fields=HISTORY_FIELDS):
         return self.service.users().history().list(
-            userId=user_id, startHistoryId=start_history_id, labelId=label_ids
+            userId=user_id, startHistoryId=start_history_id, labelId=label_ids, pageToken=page_token,
+            fields=fields,
         ).execute()
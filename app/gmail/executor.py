@@ -0,0 +1,63 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config import DEFAULT_GMAIL_ACCOUNT
+from app.gmail.client import GmailClient
+
+logger = logging.getLogger(__name__)
+
+# Number of Gmail requests that can be in flight at the same time
+GMAIL_MAX_WORKERS = int(os.getenv("GMAIL_MAX_WORKERS", "10"))
+
+_executor = ThreadPoolExecutor(max_workers=GMAIL_MAX_WORKERS, thread_name_prefix="gmail")
+_local = threading.local()
+_client_factory = GmailClient
+_factory_generation = 0
+
+
+def set_client_factory(factory):
+    """
+    Replace how per-thread clients are built, e.g. with the fake of app.gmail.fake for benchmarks.
+    Clients built by the previous factory are dropped.
+
+    :param factory: callable taking account_id= and returning an object with the GmailClient methods
+    """
+    global _client_factory, _factory_generation
+    _client_factory = factory
+    _factory_generation += 1
+
+
+def get_thread_client(account_id: str = DEFAULT_GMAIL_ACCOUNT) -> GmailClient:
+    """
+    Return the current worker thread's GmailClient for an account, creating it on first use.
+    httplib2 is not thread-safe, so every thread needs its own service object per account.
+    """
+    clients = getattr(_local, "clients", None)
+    if clients is None or _local.generation != _factory_generation:
+        clients = _local.clients = {}
+        _local.generation = _factory_generation
+    client = clients.get(account_id)
+    if client is None:
+        client = clients[account_id] = _client_factory(account_id=account_id)
+        logger.debug(
+            "Created Gmail client for account=%s thread=%s", account_id, threading.current_thread().name
+        )
+    return client
+
+
+async def run_gmail(func, account_id: str = DEFAULT_GMAIL_ACCOUNT):
+    """
+    Run func(client) in the Gmail thread pool without blocking the event loop.
+    The pool is shared by all accounts.
+
+    :param func: callable receiving the thread's GmailClient for account_id
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, lambda: func(get_thread_client(account_id)))
+
+
+def shutdown_gmail_executor(wait: bool = True):
+    _executor.shutdown(wait=wait)
@@ -0,0 +1,337 @@
+import base64
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+# In-process stand-in for the Gmail API, used by scripts/bench_sync.py.
+# Install it with app.gmail.executor.set_client_factory, the sync code is unchanged.
+
+MIME_STRUCTURES = ("plain", "html", "alternative", "mixed")
+
+FAKE_LABELS = [
+    {"id": "INBOX", "name": "INBOX"},
+    {"id": "UNREAD", "name": "UNREAD"},
+    {"id": "Label_1", "name": "work"},
+    {"id": "Label_2", "name": "personal"},
+    {"id": "Label_3", "name": "newsletter"},
+]
+
+LIST_PAGE_SIZE = 100
+HISTORY_PAGE_SIZE = 100
+
+_WORDS = (
+    "invoice meeting project update report budget review team schedule travel offer order "
+    "shipping account password weekend family dinner photos newsletter release notes agenda"
+).split()
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def _http_error(status: int) -> HttpError:
+    reason = "rateLimitExceeded" if status == 429 else "backendError"
+    content = json.dumps({"error": {"code": status, "message": reason, "errors": [{"reason": reason}]}})
+    return HttpError(httplib2.Response({"status": status}), content.encode())
+
+
+class FakeStats:
+    """
+    Thread-safe counters of the API traffic the fake served.
+
+    - http_calls: HTTP round trips per method, a batch call counts once
+    - requests: API method calls per method, every batch sub-request counts
+    - errors: injected errors per HTTP status
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.http_calls = Counter()
+            self.requests = Counter()
+            self.errors = Counter()
+
+    def record(self, method: str, http_calls: int = 1, requests: int = 1):
+        with self._lock:
+            self.http_calls[method] += http_calls
+            self.requests[method] += requests
+
+    def record_error(self, status: int):
+        with self._lock:
+            self.errors[status] += 1
+
+
+class FakeMailbox:
+    """
+    Synthetic mailbox with Gmail-like listing and history, shared by all fake clients of an account.
+
+    :param size: number of messages
+    :param structure: MIME structure of the messages, one of MIME_STRUCTURES or "random"
+    :param body_chars: approximate body length
+    :param days: messages are spread evenly over this many days up to now
+    """
+
+    def __init__(
+        self,
+        size: int = 1000,
+        structure: str = "alternative",
+        body_chars: int = 2000,
+        days: int = 365,
+        seed: int = 0,
+        email_address: str = "bench@example.com",
+    ):
+        if structure != "random" and structure not in MIME_STRUCTURES:
+            raise ValueError(f"Unknown MIME structure {structure!r}")
+        self.structure = structure
+        self.body_chars = body_chars
+        self.email_address = email_address
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next_id = 0x10000000
+        self.history_id = 1000
+        self._oldest_history_id = self.history_id
+        self._history = []
+        self.messages = {}
+
+        now = datetime.now(timezone.utc)
+        step = timedelta(days=days) / max(size, 1)
+        for i in range(size):
+            message = self._make_message(now - step * (size - i))
+            self.messages[message["id"]] = message
+
+    # generation
+    def _text(self) -> str:
+        words = []
+        length = 0
+        while length < self.body_chars:
+            word = self._rng.choice(_WORDS)
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)
+
+    def _payload(self, subject: str, sent: datetime):
+        headers = [
+            {"name": "From", "value": f"sender{self._rng.randrange(500)}@example.com"},
+            {"name": "To", "value": self.email_address},
+            {"name": "Subject", "value": subject},
+            {"name": "Date", "value": format_datetime(sent)},
+        ]
+        text = self._text()
+        plain = {
+            "mimeType": "text/plain",
+            "headers": [{"name": "Content-Type", "value": "text/plain; charset=utf-8"}],
+            "body": {"data": _b64(text.encode("utf-8"))},
+        }
+        html = {
+            "mimeType": "text/html",
+            "headers": [{"name": "Content-Type", "value": "text/html; charset=utf-8"}],
+            "body": {"data": _b64(f"<html><body><p>{text}</p></body></html>".encode("utf-8"))},
+        }
+
+        structure = self.structure
+        if structure == "random":
+            structure = self._rng.choice(MIME_STRUCTURES)
+        if structure == "plain":
+            return {**plain, "headers": headers + plain["headers"]}
+        if structure == "html":
+            return {**html, "headers": headers + html["headers"]}
+
+        alternative = {"mimeType": "multipart/alternative", "headers": [], "parts": [plain, html]}
+        if structure == "alternative":
+            return {**alternative, "headers": headers}
+        attachment = {
+            "mimeType": "application/pdf",
+            "filename": "invoice.pdf",
+            "headers": [{"name": "Content-Disposition", "value": "attachment; filename=invoice.pdf"}],
+            "body": {"attachmentId": f"att-{self._rng.randrange(10 ** 9)}", "size": 50_000},
+        }
+        return {"mimeType": "multipart/mixed", "headers": headers, "parts": [alternative, attachment]}
+
+    def _make_message(self, sent: datetime):
+        msg_id = f"{self._next_id:016x}"
+        self._next_id += 1
+        label_ids = ["INBOX"] + self._rng.sample([label["id"] for label in FAKE_LABELS[1:]], k=2)
+        return {
+            "id": msg_id,
+            "threadId": msg_id,
+            "labelIds": label_ids,
+            "internalDate": str(int(sent.timestamp() * 1000)),
+            "payload": self._payload(f"{self._rng.choice(_WORDS)} {msg_id}", sent),
+        }
+
+    # changes, recorded in the history like Gmail does
+    def _record(self, key: str, message):
+        self.history_id += 1
+        self._history.append({"id": str(self.history_id), key: [{"message": message}]})
+
+    def add(self, count: int):
+        with self._lock:
+            for _ in range(count):
+                message = self._make_message(datetime.now(timezone.utc))
+                self.messages[message["id"]] = message
+                self._record("messagesAdded", {"id": message["id"], "threadId": message["threadId"]})
+
+    def delete(self, count: int):
+        with self._lock:
+            for msg_id in self._rng.sample(sorted(self.messages), k=min(count, len(self.messages))):
+                del self.messages[msg_id]
+                self._record("messagesDeleted", {"id": msg_id})
+
+    def relabel(self, count: int):
+        with self._lock:
+            for msg_id in self._rng.sample(sorted(self.messages), k=min(count, len(self.messages))):
+                message = self.messages[msg_id]
+                if "UNREAD" in message["labelIds"]:
+                    message["labelIds"] = [label for label in message["labelIds"] if label != "UNREAD"]
+                    key = "labelsRemoved"
+                else:
+                    message["labelIds"] = message["labelIds"] + ["UNREAD"]
+                    key = "labelsAdded"
+                self._record(key, {"id": msg_id, "labelIds": list(message["labelIds"])})
+
+    def expire_history(self):
+        """
+        Forget all history, the next incremental sync gets a 404 and falls back to a full sync.
+        """
+        with self._lock:
+            self._history = []
+            self._oldest_history_id = self.history_id
+
+    # reads
+    def list(self, query=None, page_token=None):
+        after, before = float("-inf"), float("inf")
+        for op, value in re.findall(r"(after|before):(\d+)", query or ""):
+            if op == "after":
+                after = int(value)
+            else:
+                before = int(value)
+
+        with self._lock:
+            ids = [
+                m["id"] for m in self.messages.values()
+                if after < int(m["internalDate"]) // 1000 < before
+            ]
+        ids.sort(reverse=True)  # newest first, like Gmail
+        offset = int(page_token or 0)
+        response = {"messages": [{"id": msg_id} for msg_id in ids[offset:offset + LIST_PAGE_SIZE]]}
+        if offset + LIST_PAGE_SIZE < len(ids):
+            response["nextPageToken"] = str(offset + LIST_PAGE_SIZE)
+        return response
+
+    def get(self, msg_id: str, format: str):
+        with self._lock:
+            message = self.messages.get(msg_id)
+        if message is None:
+            raise _http_error(404)
+        if format == "minimal":
+            return {k: message[k] for k in ("id", "threadId", "labelIds")}
+        return message
+
+    def history_since(self, start_history_id, page_token=None):
+        start = int(start_history_id)
+        with self._lock:
+            if start < self._oldest_history_id:
+                raise _http_error(404)
+            records = [r for r in self._history if int(r["id"]) > start]
+            history_id = self.history_id
+        offset = int(page_token or 0)
+        response = {"history": records[offset:offset + HISTORY_PAGE_SIZE], "historyId": str(history_id)}
+        if offset + HISTORY_PAGE_SIZE < len(records):
+            response["nextPageToken"] = str(offset + HISTORY_PAGE_SIZE)
+        return response
+
+
+class FakeGmailClient:
+    """
+    Drop-in for GmailClient backed by a FakeMailbox.
+
+    :param latency: seconds every HTTP round trip takes, batch calls included
+    :param error_rate: probability that a call (or batch sub-request) fails with one of error_statuses
+    """
+
+    def __init__(
+        self,
+        mailbox: FakeMailbox,
+        *,
+        account_id: str = "bench",
+        stats: FakeStats | None = None,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        error_statuses=(429, 503),
+        seed: int | None = None,
+    ):
+        self.account_id = account_id
+        self.mailbox = mailbox
+        self.stats = stats or FakeStats()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self._rng = random.Random(seed)
+
+    def _round_trip(self, method: str, requests: int = 1):
+        self.stats.record(method, requests=requests)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _maybe_fail(self):
+        if self.error_rate and self._rng.random() < self.error_rate:
+            status = self._rng.choice(self.error_statuses)
+            self.stats.record_error(status)
+            return _http_error(status)
+        return None
+
+    def _call(self, method: str):
+        self._round_trip(method)
+        error = self._maybe_fail()
+        if error is not None:
+            raise error
+
+    def get_profile(self, user_id="me"):
+        self._call("getProfile")
+        return {"emailAddress": self.mailbox.email_address, "historyId": str(self.mailbox.history_id)}
+
+    def list_messages(self, user_id="me", label_ids=None, page_token=None, query=None, fields=None):
+        self._call("messages.list")
+        return self.mailbox.list(query=query, page_token=page_token)
+
+    def get_message(self, msg_id, user_id="me", format="full", fields=None):
+        self._call("messages.get")
+        return self.mailbox.get(msg_id, format)
+
+    def get_messages_batch(self, msg_ids, user_id="me", format="full", fields=None):
+        unique_ids = list(dict.fromkeys(msg_ids))
+        self._round_trip("messages.get", requests=len(unique_ids))
+        messages, errors = {}, {}
+        for msg_id in unique_ids:
+            error = self._maybe_fail()
+            if error is None:
+                try:
+                    messages[msg_id] = self.mailbox.get(msg_id, format)
+                    continue
+                except HttpError as e:
+                    error = e
+            errors[msg_id] = error
+        return messages, errors
+
+    def watch(self, topic_name, user_id="me", label_ids=None):
+        self._call("watch")
+        return {"historyId": str(self.mailbox.history_id), "expiration": str(int(time.time() * 1000) + 7 * 86400000)}
+
+    def list_labels(self, user_id="me"):
+        self._call("labels.list")
+        return list(FAKE_LABELS)
+
+    def get_history(self, start_history_id, user_id="me", label_ids=None, page_token=None, fields=None):
+        self._call("history.list")
+        return self.mailbox.history_since(start_history_id, page_token=page_token)
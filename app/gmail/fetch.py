@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import os
+import time
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from app.config import DEFAULT_GMAIL_ACCOUNT
+from app.gmail.executor import GMAIL_MAX_WORKERS, run_gmail
+from app.gmail.ratelimit import backoff_delay, get_bucket, quota_units, retry_after_seconds
+from app.metrics import GMAIL_CALL_SECONDS, GMAIL_CALLS, GMAIL_QUOTA_WAIT_SECONDS, GMAIL_RETRIES
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = 5
+MAX_CONCURRENT_EMAILS = GMAIL_MAX_WORKERS
+# Sub-requests per Gmail batch call (Google recommends <= 50 to avoid rate limiting)
+GMAIL_BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", "50"))
+
+GMAIL_LABEL_MAP_TTL = float(os.getenv("GMAIL_LABEL_MAP_TTL", "900"))
+
+# Socket timeouts, connection resets and DNS hiccups are worth a retry
+TRANSIENT_NETWORK_ERRORS = (TimeoutError, ConnectionError, httplib2.HttpLib2Error)
+
+
+def _is_rate_limited(e: HttpError) -> bool:
+    if e.resp.status == 429:
+        return True
+    # Gmail also reports exhausted quota as 403 with a rate limit reason
+    if e.resp.status == 403:
+        reasons = {d.get("reason") for d in (e.error_details or []) if isinstance(d, dict)}
+        return bool(reasons & {"rateLimitExceeded", "userRateLimitExceeded"})
+    return False
+
+
+async def gmail_call(func, method: str, count: int = 1, account_id: str = DEFAULT_GMAIL_ACCOUNT):
+    """
+    Run a Gmail API call in the Gmail thread pool, retrying transient errors.
+
+    Every attempt first takes its quota units from the account's token bucket.
+    Retries use full-jitter exponential backoff and honor Retry-After.
+
+    :param func: callable receiving the thread's GmailClient, e.g. ``lambda client: client.list_labels()``
+    :param method: Gmail API method for quota accounting, e.g. "messages.get"
+    :param count: number of method calls func makes (sub-requests of a batch)
+    :param account_id: account whose credentials and quota are used
+    """
+    units = quota_units(method, count)
+    bucket = get_bucket(account_id)
+    for attempt in range(MAX_RETRIES):
+        waiting_since = time.monotonic()
+        await bucket.acquire(units)
+        started = time.monotonic()
+        GMAIL_QUOTA_WAIT_SECONDS.labels(method).observe(started - waiting_since)
+        try:
+            result = await run_gmail(func, account_id)
+            GMAIL_CALLS.labels(method, "ok").inc()
+            return result
+        except HttpError as e:
+            status = e.resp.status
+            if not (_is_rate_limited(e) or status in (500, 502, 503, 504)):
+                GMAIL_CALLS.labels(method, "error").inc()
+                logger.error("Gmail API error status=%s message=%s", status, e)
+                raise
+
+            GMAIL_CALLS.labels(method, "retry").inc()
+            GMAIL_RETRIES.labels(method, str(status)).inc()
+
+            delay = backoff_delay(attempt)
+            retry_after = retry_after_seconds(e.resp)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+                bucket.pause(retry_after)
+            elif _is_rate_limited(e):
+                bucket.drain()
+            logger.warning(
+                "Gmail API transient error status=%s method=%s account=%s retry=%s delay=%.1fs",
+                status, method, account_id, attempt + 1, delay,
+            )
+        except TRANSIENT_NETWORK_ERRORS as e:
+            GMAIL_CALLS.labels(method, "retry").inc()
+            GMAIL_RETRIES.labels(method, "network").inc()
+            delay = backoff_delay(attempt)
+            logger.warning(
+                "Gmail API network error %r method=%s account=%s retry=%s delay=%.1fs",
+                e, method, account_id, attempt + 1, delay,
+            )
+        finally:
+            GMAIL_CALL_SECONDS.labels(method).observe(time.monotonic() - started)
+        await asyncio.sleep(delay)
+    raise RuntimeError("Gmail API retry limit exceeded")
+
+
+# account_id -> {"labels": ..., "fetched_at": ...}
+_label_map_cache = {}
+
+
+async def get_label_map(account_id: str = DEFAULT_GMAIL_ACCOUNT, refresh: bool = False):
+    """
+    Label id -> name of an account, cached for GMAIL_LABEL_MAP_TTL seconds since labels rarely change.
+    A refetch updates the cached dict in place, so maps already handed out see new labels too.
+
+    :param refresh: refetch even if the cached map has not expired
+    """
+    now = time.monotonic()
+    cached = _label_map_cache.get(account_id)
+    if cached is None or refresh or now - cached["fetched_at"] > GMAIL_LABEL_MAP_TTL:
+        result = await gmail_call(lambda client: client.list_labels(), "labels.list", account_id=account_id)
+        labels = {label["id"]: label["name"] for label in result}
+        if cached is None:
+            cached = _label_map_cache[account_id] = {"labels": labels, "fetched_at": now}
+        else:
+            cached["labels"].update(labels)
+            cached["fetched_at"] = now
+    return cached["labels"]
+
+
+async def ensure_label_map(label_map, label_ids, account_id: str = DEFAULT_GMAIL_ACCOUNT):
+    """
+    Make sure label_map knows all label_ids, refetching labels.list once if it does not,
+    e.g. for a label created after the map was cached.
+    Ids still unknown afterwards are logged, the mappers skip them instead of storing the raw id.
+    """
+    missing = set(label_ids) - label_map.keys()
+    if not missing:
+        return
+    label_map.update(await get_label_map(account_id, refresh=True))
+    missing -= label_map.keys()
+    if missing:
+        logger.warning("Skipping unknown Gmail labels account=%s labels=%s", account_id, sorted(missing))
+
+
+async def fetch_message_batch(msg_ids, format="full", account_id: str = DEFAULT_GMAIL_ACCOUNT):
+    """
+    Fetch messages through the Gmail batch endpoint.
+    format is minimal / metadata / full, each with a trimmed field mask (see GmailClient).
+    Sub-requests that failed are retried one by one via gmail_call.
+    Messages deleted in the meantime (404) are skipped.
+    """
+    # split the page so several batch calls are in flight in parallel
+    chunks = [msg_ids[i:i + GMAIL_BATCH_SIZE] for i in range(0, len(msg_ids), GMAIL_BATCH_SIZE)]
+    results = await asyncio.gather(
+        *(
+            gmail_call(
+                lambda client, chunk=chunk: client.get_messages_batch(chunk, format=format),
+                "messages.get",
+                len(chunk),
+                account_id=account_id,
+            )
+            for chunk in chunks
+        )
+    )
+    messages, errors = {}, {}
+    for chunk_messages, chunk_errors in results:
+        messages.update(chunk_messages)
+        errors.update(chunk_errors)
+    if any(isinstance(e, HttpError) and _is_rate_limited(e) for e in errors.values()):
+        get_bucket(account_id).drain()
+    for e in errors.values():
+        GMAIL_RETRIES.labels("messages.get", str(e.resp.status) if isinstance(e, HttpError) else "network").inc()
+    if errors:
+        logger.warning("Gmail batch returned %s failed sub-requests, retrying them individually", len(errors))
+
+    sem = asyncio.Semaphore(MAX_CONCURRENT_EMAILS)
+
+    async def retry_single(mid):
+        async with sem:
+            try:
+                messages[mid] = await gmail_call(
+                    lambda client: client.get_message(mid, format=format), "messages.get", account_id=account_id
+                )
+            except HttpError as e:
+                if e.resp.status == 404:
+                    logger.warning("Message id=%s no longer exists, skipping", mid)
+                    return
+                raise
+
+    await asyncio.gather(*(retry_single(mid) for mid in errors))
+
+    # keep the order of the listing
+    return [messages[mid] for mid in dict.fromkeys(msg_ids) if mid in messages]
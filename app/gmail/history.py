@@ -0,0 +1,152 @@
+import logging
+
+from sqlalchemy import delete, exists, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import DEFAULT_GMAIL_ACCOUNT
+from app.db.labels import group_label_ids, junction_rows, label_ids, replace_label_sets
+from app.gmail.fetch import ensure_label_map, gmail_call
+from app.models.email import Email
+from app.models.email_body import EmailBody
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryChanges:
+    """
+    Deduplicated change set coalesced from Gmail history records.
+
+    - added: messages to download
+    - deleted: messages to remove from the database
+    - labels: msg_id -> final labelIds for messages whose labels changed only
+    """
+
+    def __init__(self):
+        self.added = set()
+        self.deleted = set()
+        self.labels = {}
+
+    def __len__(self):
+        return len(self.added) + len(self.deleted) + len(self.labels)
+
+
+async def list_history(start_history_id, account_id: str = DEFAULT_GMAIL_ACCOUNT):
+    """
+    Read all pages of an account's history.list since start_history_id.
+    Raises HttpError 404 if the history id expired.
+
+    :return: (history records, latest history id of the mailbox)
+    """
+    records = []
+    history_id = start_history_id
+    next_page_token = None
+    while True:
+        response = await gmail_call(
+            lambda client: client.get_history(start_history_id=start_history_id, page_token=next_page_token),
+            "history.list",
+            account_id=account_id,
+        )
+        records.extend(response.get("history", []))
+        history_id = response.get("historyId", history_id)
+
+        next_page_token = response.get("nextPageToken")
+        if not next_page_token:
+            break
+
+    logger.debug("Read history records=%s up to history_id=%s", len(records), history_id)
+    return records, history_id
+
+
+def coalesce_history(records) -> HistoryChanges:
+    """
+    Fold history records (oldest first) into one change set.
+    A deletion wins over everything, a new message is downloaded with its current labels
+    anyway, write_rows replaces the label set of messages that are already stored.
+    """
+    changes = HistoryChanges()
+
+    for record in records:
+        for added in record.get("messagesAdded", []):
+            changes.added.add(added["message"]["id"])
+        for deleted in record.get("messagesDeleted", []):
+            changes.deleted.add(deleted["message"]["id"])
+        # message.labelIds holds the full label list after the change, the last one wins
+        for key in ("labelsAdded", "labelsRemoved"):
+            for change in record.get(key, []):
+                message = change["message"]
+                changes.labels[message["id"]] = message.get("labelIds", [])
+
+    changes.added -= changes.deleted
+    for msg_id in changes.deleted | changes.added:
+        changes.labels.pop(msg_id, None)
+
+    return changes
+
+
+async def replace_labels(db: AsyncSession, labels, label_map, account_id: str):
+    """
+    Replace the email_labels rows of stored messages, the caller commits.
+
+    :param labels: msg_id -> current Gmail labelIds
+    """
+    if not labels:
+        return
+
+    await ensure_label_map(label_map, (label_id for ids in labels.values() for label_id in ids), account_id)
+    label_rows = [
+        {"email_id": msg_id, "name": label_map[gmail_label_id]}
+        for msg_id, gmail_label_ids in labels.items()
+        for gmail_label_id in gmail_label_ids
+        if gmail_label_id in label_map
+    ]
+    ids = await label_ids(row["name"] for row in label_rows)
+    # only emails whose label set differs are rewritten, e.g. a refresh after history expiry
+    # touches every email and must not make the online model learn them again
+    await replace_label_sets(db, group_label_ids(labels.keys(), junction_rows(label_rows, ids)))
+
+
+async def prune_orphan_bodies(db: AsyncSession, hashes):
+    """
+    Delete the given bodies unless another email still references them, the caller commits.
+    """
+    hashes = [h for h in set(hashes) if h]
+    if not hashes:
+        return
+    await db.execute(
+        delete(EmailBody)
+        .where(EmailBody.hash.in_(hashes))
+        .where(~exists(select(Email.id).where(Email.body_hash == EmailBody.hash)))
+    )
+
+
+async def apply_history_changes(db: AsyncSession, changes: HistoryChanges, label_map, account_id: str):
+    """
+    Apply deletions and label-only changes straight to the database, the caller commits.
+    Label changes of messages we never stored are moved to changes.added instead.
+    """
+    if changes.deleted:
+        # labels follow via ON DELETE CASCADE
+        result = await db.execute(
+            delete(Email)
+            .where(Email.id.in_(changes.deleted))
+            .where(Email.account_id == account_id)
+            .returning(Email.body_hash)
+        )
+        await prune_orphan_bodies(db, result.scalars().all())
+
+    if changes.labels:
+        result = await db.execute(
+            select(Email.id).where(Email.id.in_(changes.labels.keys())).where(Email.account_id == account_id)
+        )
+        known = set(result.scalars().all())
+        changes.added |= changes.labels.keys() - known
+        changes.labels = {msg_id: label_ids for msg_id, label_ids in changes.labels.items() if msg_id in known}
+
+    await replace_labels(db, changes.labels, label_map, account_id)
+
+    logger.info(
+        "Applied history changes deleted=%s relabeled=%s to_fetch=%s",
+        len(changes.deleted),
+        len(changes.labels),
+        len(changes.added),
+    )
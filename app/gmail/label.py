@@ -1,6 +1,6 @@
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
-from app.models import Email, Label
+from app.models import Email, LabelName
 from app.db import AsyncSessionLocal
 from collections import Counter
 import numpy as np
@@ -10,10 +10,10 @@ async def fetch_labeled_emails():
     async with AsyncSessionLocal() as session:
         stmt = (
             select(Email)
-            .options(selectinload(Email.labels))
+            .options(selectinload(Email.labels), selectinload(Email.body_blob))
             .where(Email.labels.any())
             .where(
-                Email.labels.any(Label.name != "INBOX")
+                Email.labels.any(LabelName.name != "INBOX")
             )
         )
 
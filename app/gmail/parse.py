@@ -0,0 +1,202 @@
+import base64
+import logging
+import os
+from datetime import timezone
+from email.message import Message
+from email.utils import parsedate_to_datetime
+from html.parser import HTMLParser
+from typing import Optional
+
+from app.db.bodies import body_row
+from app.db.search import SEARCH_BODY_CHARS
+
+logger = logging.getLogger(__name__)
+
+# Longer bodies are truncated, nothing downstream needs more
+MAX_BODY_CHARS = int(os.getenv("MAX_BODY_CHARS", "100000"))
+
+
+def safe_parse_date(value: Optional[str]):
+    if not value:
+        return None
+    try:
+        dt = parsedate_to_datetime(value)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt
+    except ValueError:
+        logger.warning("Invalid date header value=%r", value)
+        return None
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """
+    Collects the visible text of an HTML document, skipping script/style/head.
+    """
+    SKIP_TAGS = {"script", "style", "title"}
+    # elements allowed in head, any other start tag or text ends a head whose </head> was left out
+    HEAD_TAGS = {"base", "link", "meta", "noscript", "script", "style", "template", "title"}
+    BLOCK_TAGS = {"br", "p", "div", "tr", "li", "h1", "h2", "h3", "h4", "h5", "h6", "table", "blockquote"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self._skip_depth = 0
+        self._in_head = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "head":
+            self._in_head = True
+            return
+        if self._in_head and tag not in self.HEAD_TAGS:
+            self._in_head = False
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.chunks.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag == "head":
+            self._in_head = False
+        elif tag in self.SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag in self.BLOCK_TAGS:
+            self.chunks.append("\n")
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        if self._in_head:
+            if not data.strip():
+                return
+            self._in_head = False
+        self.chunks.append(data)
+
+
+def html_to_text(html: str) -> str:
+    parser = _HTMLTextExtractor()
+    parser.feed(html)
+    parser.close()
+    text = "".join(parser.chunks)
+    # collapse the whitespace runs HTML layout leaves behind
+    lines = (" ".join(line.split()) for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def _part_headers(part):
+    return {h["name"].lower(): h["value"] for h in part.get("headers", [])}
+
+
+def _is_attachment(part, headers) -> bool:
+    body = part.get("body", {})
+    return bool(
+        part.get("filename")
+        or body.get("attachmentId")
+        or headers.get("content-disposition", "").lower().startswith("attachment")
+    )
+
+
+def _decode_part(part, headers, max_bytes: int) -> str:
+    data = part.get("body", {}).get("data")
+    if not data:
+        return ""
+
+    # only decode what can end up in the capped text (4 base64 chars -> 3 bytes)
+    max_chars = (max_bytes // 3 + 1) * 4
+    raw = base64.urlsafe_b64decode(data[:max_chars] + "=" * (-len(data[:max_chars]) % 4))
+
+    charset = Message()
+    charset["content-type"] = headers.get("content-type", part.get("mimeType", "text/plain"))
+    encoding = charset.get_content_charset() or "utf-8"
+    try:
+        return raw.decode(encoding, errors="replace")
+    except LookupError:
+        logger.debug("Unknown charset=%r, decoding as utf-8", encoding)
+        return raw.decode("utf-8", errors="replace")
+
+
+def get_plain_text(payload, max_chars: int = MAX_BODY_CHARS):
+    """
+    Extract the body text of a Gmail message payload.
+
+    Walks nested multipart payloads iteratively in document order, decodes
+    inline text/plain parts with their declared charset and falls back to
+    text/html converted to text if there is no plain part. Attachments are
+    skipped without being decoded, the result is capped at max_chars.
+    """
+    plain, html = [], []
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        children = part.get("parts")
+        if children:
+            stack.extend(reversed(children))
+            continue
+
+        mime_type = part.get("mimeType", "").lower()
+        if mime_type not in ("text/plain", "text/html"):
+            continue
+        headers = _part_headers(part)
+        if _is_attachment(part, headers):
+            continue
+
+        # a character may take up to 4 bytes
+        text = _decode_part(part, headers, max_bytes=max_chars * 4)
+        (plain if mime_type == "text/plain" else html).append(text)
+
+    if any(t.strip() for t in plain):
+        text = "\n".join(plain)
+    elif html:
+        text = html_to_text("\n".join(html))
+    else:
+        return ""
+    return text[:max_chars]
+
+
+def message_to_rows(msg, label_map, account_id):
+    """
+    Map a Gmail message resource of an account to an emails row, its labels rows,
+    its compressed email_bodies row (None for an empty body) and its search text row.
+    """
+    headers = {h["name"]: h["value"] for h in msg["payload"]["headers"]}
+
+    email_row = {
+        "id": msg["id"],
+        "account_id": account_id,
+        "thread_id": msg["threadId"],
+        "from_address": headers.get("From"),
+        "to_address": headers.get("To", os.getenv("DEFAULT_TO_ADDRESS", "undi@sclos.ed")),
+        "subject": headers.get("Subject"),
+        "date_sent": safe_parse_date(headers.get("Date")),
+    }
+    text = get_plain_text(msg["payload"])
+    body = body_row(text)
+    email_row["body_hash"] = body["hash"] if body else None
+    search_row = {"id": msg["id"], "subject": email_row["subject"], "body": text[:SEARCH_BODY_CHARS]}
+
+    # names are mapped to label_names ids by the writer, see ensure_label_map for unknown ids
+    label_rows = [
+        {"email_id": msg["id"], "name": label_map[label_id]}
+        for label_id in msg.get("labelIds", [])
+        if label_id in label_map
+    ]
+
+    return email_row, label_rows, body, search_row
+
+
+def messages_to_rows(messages, label_map, account_id):
+    """
+    Map a chunk of Gmail messages to emails rows, labels rows, email_bodies rows and search text rows.
+    """
+    email_rows = []
+    label_rows = []
+    body_rows = []
+    search_rows = []
+    for msg in messages:
+        email_row, msg_label_rows, body, search_row = message_to_rows(msg, label_map, account_id)
+        email_rows.append(email_row)
+        label_rows.extend(msg_label_rows)
+        if body:
+            body_rows.append(body)
+        search_rows.append(search_row)
+    return email_rows, label_rows, body_rows, search_rows
@@ -0,0 +1,342 @@
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.bulk import bulk_upsert
+from app.db.labels import group_label_ids, junction_rows, label_ids, replace_label_sets, stored_label_ids
+from app.db.search import update_search_vectors
+from app.db.session import AsyncSessionLocal
+from app.db.utils import commit_or_rollback
+from app.gmail.executor import GMAIL_MAX_WORKERS
+from app.gmail.fetch import GMAIL_BATCH_SIZE, ensure_label_map, fetch_message_batch
+from app.gmail.history import replace_labels
+from app.gmail.parse import messages_to_rows
+from app.metrics import SYNC_MESSAGES, SYNC_MESSAGES_PER_SECOND, SYNC_QUEUE_DEPTH, SYNC_STAGE_SECONDS
+from app.models.email import Email
+from app.models.email_body import EmailBody
+from app.models.label import EmailLabel
+from app.models.sync_state import SyncState
+
+logger = logging.getLogger(__name__)
+
+# Tunables per stage, see SyncPipeline
+SYNC_FETCH_WORKERS = int(os.getenv("SYNC_FETCH_WORKERS", str(GMAIL_MAX_WORKERS)))
+SYNC_PARSE_WORKERS = int(os.getenv("SYNC_PARSE_WORKERS", "2"))
+SYNC_QUEUE_SIZE = int(os.getenv("SYNC_QUEUE_SIZE", "20"))
+SYNC_WRITE_BATCH_SIZE = int(os.getenv("SYNC_WRITE_BATCH_SIZE", "1000"))
+SYNC_WRITE_INTERVAL = float(os.getenv("SYNC_WRITE_INTERVAL", "5"))
+
+# labels_changed_at is set by write_rows, and only when the trainable labels change
+EMAIL_UPDATE_COLUMNS = [
+    "thread_id", "from_address", "to_address", "subject", "date_sent", "body_hash",
+]
+
+# Sentinel telling a stage worker to stop
+_DONE = object()
+
+
+async def foreign_email_ids(db: AsyncSession, email_rows) -> set[str]:
+    """
+    Ids of email_rows already stored under a different account.
+    emails.id is the bare Gmail id, an upsert would keep the row attributed to the first account.
+    """
+    accounts = {row["id"]: row["account_id"] for row in email_rows}
+    if not accounts:
+        return set()
+    result = await db.execute(select(Email.id, Email.account_id).where(Email.id.in_(accounts.keys())))
+    return {email_id for email_id, account_id in result.tuples().all() if account_id != accounts[email_id]}
+
+
+async def write_rows(db: AsyncSession, email_rows, label_rows, body_rows, search_rows):
+    """
+    Persist parsed messages with one bulk statement per table.
+    Messages whose id is stored under another account are logged and skipped.
+    """
+    foreign = await foreign_email_ids(db, email_rows)
+    if foreign:
+        logger.warning("Skipping messages stored under another account ids=%s", sorted(foreign))
+        email_rows = [row for row in email_rows if row["id"] not in foreign]
+        label_rows = [row for row in label_rows if row["email_id"] not in foreign]
+        search_rows = [row for row in search_rows if row["id"] not in foreign]
+        hashes = {row["body_hash"] for row in email_rows}
+        body_rows = [row for row in body_rows if row["hash"] in hashes]
+
+    # referenced rows first: bodies <- emails <- email_labels
+    ids = await label_ids(row["name"] for row in label_rows)
+    sets = group_label_ids((row["id"] for row in email_rows), junction_rows(label_rows, ids))
+    # looked up before the upsert, so it tells stored emails from new ones
+    stored = await stored_label_ids(db, sets.keys())
+    await bulk_upsert(db, EmailBody.__table__, body_rows, index_elements=["hash"])
+    await bulk_upsert(
+        db,
+        Email.__table__,
+        email_rows,
+        index_elements=["id"],
+        update_columns=EMAIL_UPDATE_COLUMNS,
+    )
+    await update_search_vectors(db, search_rows)
+    # a stored email downloaded again (e.g. added and relabeled in the same history window)
+    # gets its label set replaced, labels removed in Gmail would otherwise stay forever
+    await replace_label_sets(db, {email_id: sets[email_id] for email_id in stored}, stored)
+    # new emails take labels_changed_at from the server default
+    await bulk_upsert(
+        db,
+        EmailLabel.__table__,
+        [
+            {"email_id": email_id, "label_id": label_id}
+            for email_id, label_set in sets.items() if email_id not in stored
+            for label_id in label_set
+        ],
+        index_elements=["email_id", "label_id"],
+    )
+
+
+async def split_known_ids(msg_ids, account_id: str):
+    """
+    Split ids into (unknown, known) with one primary key lookup.
+    """
+    if not msg_ids:
+        return [], []
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(Email.id).where(Email.id.in_(msg_ids)).where(Email.account_id == account_id)
+        )
+        known = set(result.scalars().all())
+    return [msg_id for msg_id in msg_ids if msg_id not in known], [msg_id for msg_id in msg_ids if msg_id in known]
+
+
+async def refresh_labels(label_map, sync_state_id: str, msg_ids):
+    """
+    Update labels of stored messages from a minimal fetch, without downloading bodies.
+    """
+    messages = await fetch_message_batch(msg_ids, format="minimal", account_id=sync_state_id)
+    async with AsyncSessionLocal() as db:
+        await replace_labels(db, {m["id"]: m.get("labelIds", []) for m in messages}, label_map, sync_state_id)
+        await commit_or_rollback(
+            db,
+            context={"sync_state_id": sync_state_id, "action": "refresh_labels"},
+        )
+
+
+class SyncPipeline:
+    """
+    Streaming fetch -> parse -> write pipeline for Gmail messages.
+
+    - fetch: several workers download chunks of message ids via the Gmail batch endpoint
+    - parse: workers map raw messages to rows in a thread, off the event loop
+    - write: a single writer with its own session commits in size- or time-based batches
+
+    Stages are connected by bounded queues, so a slow stage pushes back on the
+    ones before it and memory stays flat regardless of mailbox size.
+
+    One pipeline serves one account, sync_state_id is the account id.
+
+    Each submit() may carry a checkpoint statement (e.g. an UPDATE of SyncState).
+    It is executed in the same transaction as the last message of that submission,
+    once all earlier submissions are committed as well, so a crashed sync can resume from it.
+    """
+
+    def __init__(
+        self,
+        label_map,
+        sync_state_id: str,
+        *,
+        fetch_workers: int = SYNC_FETCH_WORKERS,
+        parse_workers: int = SYNC_PARSE_WORKERS,
+        queue_size: int = SYNC_QUEUE_SIZE,
+        write_batch_size: int = SYNC_WRITE_BATCH_SIZE,
+        write_interval: float = SYNC_WRITE_INTERVAL,
+    ):
+        self.label_map = label_map
+        self.sync_state_id = sync_state_id
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers
+        self.write_batch_size = write_batch_size
+        self.write_interval = write_interval
+
+        self.fetch_queue = asyncio.Queue(maxsize=queue_size)
+        self.parse_queue = asyncio.Queue(maxsize=queue_size)
+        self.write_queue = asyncio.Queue(maxsize=queue_size)
+
+        self.written = 0
+
+        # submission seq -> chunks not yet committed / checkpoint to execute when done
+        self._pending = {}
+        self._checkpoints = {}
+        self._next_seq = 0
+        self._committed_seq = -1
+
+    async def submit(self, msg_ids, checkpoint=None):
+        """
+        Queue message ids for fetching. Blocks while the fetch queue is full.
+
+        :param checkpoint: statement to execute once these ids are committed
+        """
+        seq = self._next_seq
+        self._next_seq += 1
+        if checkpoint is not None:
+            self._checkpoints[seq] = checkpoint
+
+        chunks = [msg_ids[i:i + GMAIL_BATCH_SIZE] for i in range(0, len(msg_ids), GMAIL_BATCH_SIZE)]
+        if not chunks:
+            # nothing to fetch, hand the writer an empty chunk so the checkpoint still gets written
+            self._pending[seq] = 1
+            await self.write_queue.put((seq, ([], [], [], [])))
+            return
+
+        self._pending[seq] = len(chunks)
+        for chunk in chunks:
+            await self.fetch_queue.put((seq, chunk))
+
+    def _complete(self, seqs):
+        """
+        Mark chunks as committed and return the checkpoints whose submissions and predecessors are all done.
+        """
+        for seq in seqs:
+            self._pending[seq] -= 1
+
+        checkpoints = []
+        while self._pending.get(self._committed_seq + 1) == 0:
+            self._committed_seq += 1
+            del self._pending[self._committed_seq]
+            if self._committed_seq in self._checkpoints:
+                checkpoints.append(self._checkpoints.pop(self._committed_seq))
+        return checkpoints
+
+    async def run(self, produce):
+        """
+        Run all stages until produce() returned and everything it submitted is written.
+
+        :param produce: async callable receiving the pipeline, feeds ids via ``await pipeline.submit(ids)``
+        :return: number of written messages
+        """
+        started = time.monotonic()
+        try:
+            async with asyncio.TaskGroup() as tg:
+                fetchers = [tg.create_task(self._fetch_worker()) for _ in range(self.fetch_workers)]
+                parsers = [tg.create_task(self._parse_worker()) for _ in range(self.parse_workers)]
+                writer = tg.create_task(self._write_worker())
+
+                await produce(self)
+
+                # shut the stages down in order, each one drains its queue first
+                await self._stop(self.fetch_queue, fetchers)
+                await self._stop(self.parse_queue, parsers)
+                await self._stop(self.write_queue, [writer])
+        except ExceptionGroup as eg:
+            # surface the original error to callers (e.g. HttpError handling in sync_gmail)
+            raise eg.exceptions[0]
+        finally:
+            for name in ("fetch", "parse", "write"):
+                SYNC_QUEUE_DEPTH.labels(self.sync_state_id, name).set(0)
+
+        elapsed = time.monotonic() - started
+        if elapsed > 0:
+            SYNC_MESSAGES_PER_SECOND.labels(self.sync_state_id).set(self.written / elapsed)
+        return self.written
+
+    def _observe_depth(self, name: str, queue: asyncio.Queue):
+        SYNC_QUEUE_DEPTH.labels(self.sync_state_id, name).set(queue.qsize())
+
+    @staticmethod
+    async def _stop(queue: asyncio.Queue, workers):
+        for _ in workers:
+            await queue.put(_DONE)
+        await asyncio.gather(*workers)
+
+    async def _fetch_worker(self):
+        while True:
+            item = await self.fetch_queue.get()
+            self._observe_depth("fetch", self.fetch_queue)
+            if item is _DONE:
+                return
+            seq, msg_ids = item
+            with SYNC_STAGE_SECONDS.labels("fetch").time():
+                messages = await fetch_message_batch(msg_ids, account_id=self.sync_state_id)
+            # forwarded even when empty, the writer has to account for every chunk
+            await self.parse_queue.put((seq, messages))
+
+    async def _parse_worker(self):
+        while True:
+            item = await self.parse_queue.get()
+            self._observe_depth("parse", self.parse_queue)
+            if item is _DONE:
+                return
+            seq, messages = item
+            await ensure_label_map(
+                self.label_map,
+                (label_id for msg in messages for label_id in msg.get("labelIds", [])),
+                self.sync_state_id,
+            )
+            with SYNC_STAGE_SECONDS.labels("parse").time():
+                rows = await asyncio.to_thread(messages_to_rows, messages, self.label_map, self.sync_state_id)
+            await self.write_queue.put((seq, rows))
+
+    async def _write_worker(self):
+        loop = asyncio.get_running_loop()
+        email_rows, label_rows, body_rows, search_rows, seqs = [], [], [], [], []
+        deadline = None
+
+        async with AsyncSessionLocal() as db:
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - loop.time())
+                try:
+                    item = await asyncio.wait_for(self.write_queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    item = None
+                self._observe_depth("write", self.write_queue)
+
+                if item is not None and item is not _DONE:
+                    seq, (chunk_emails, chunk_labels, chunk_bodies, chunk_search) = item
+                    email_rows.extend(chunk_emails)
+                    label_rows.extend(chunk_labels)
+                    body_rows.extend(chunk_bodies)
+                    search_rows.extend(chunk_search)
+                    seqs.append(seq)
+                    if deadline is None:
+                        deadline = loop.time() + self.write_interval
+
+                if seqs and (
+                    item is None or item is _DONE or len(email_rows) >= self.write_batch_size
+                ):
+                    await self._flush(db, email_rows, label_rows, body_rows, search_rows, seqs)
+                    email_rows, label_rows, body_rows, search_rows, seqs = [], [], [], [], []
+                    deadline = None
+
+                if item is _DONE:
+                    return
+
+    async def _flush(self, db: AsyncSession, email_rows, label_rows, body_rows, search_rows, seqs):
+        started = time.monotonic()
+        await write_rows(db, email_rows, label_rows, body_rows, search_rows)
+        # progress is committed together with the data it describes
+        await db.execute(
+            update(SyncState)
+            .where(SyncState.id == self.sync_state_id)
+            .values(processed_messages=SyncState.processed_messages + len(email_rows))
+        )
+        for checkpoint in self._complete(seqs):
+            await db.execute(checkpoint)
+        await commit_or_rollback(
+            db,
+            context={"sync_state_id": self.sync_state_id, "action": "write_batch", "messages": len(email_rows)},
+        )
+        self.written += len(email_rows)
+        SYNC_MESSAGES.labels(self.sync_state_id).inc(len(email_rows))
+        SYNC_STAGE_SECONDS.labels("write").observe(time.monotonic() - started)
+        logger.debug("Committed messages=%s labels=%s", len(email_rows), len(label_rows))
+
+
+async def submit_page(pipeline: SyncPipeline, msg_ids, checkpoint, refresh_known_labels: bool = False):
+    """
+    Submit one listed page of a full sync: only unknown messages are downloaded,
+    known ones optionally get their labels refreshed.
+    """
+    unknown_ids, known_ids = await split_known_ids(msg_ids, pipeline.sync_state_id)
+    if refresh_known_labels and known_ids:
+        await refresh_labels(pipeline.label_map, pipeline.sync_state_id, known_ids)
+    await pipeline.submit(unknown_ids, checkpoint=checkpoint)
@@ -0,0 +1,103 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+
+from app.config import GMAIL_ACCOUNTS
+from app.db.session import AsyncSessionLocal
+from app.gmail.sync import sync_gmail
+from app.models.sync_state import SyncState
+
+logger = logging.getLogger(__name__)
+
+# Notifications arriving within this window are folded into one sync
+GMAIL_PUSH_DEBOUNCE_SECONDS = float(os.getenv("GMAIL_PUSH_DEBOUNCE_SECONDS", "2"))
+# Pub/Sub topic for users.watch, push mode is off if unset
+GMAIL_PUSH_TOPIC = os.getenv("GMAIL_PUSH_TOPIC")
+# Shared secret expected as ?token= on the push endpoint, push is refused while it is unset
+GMAIL_PUSH_TOKEN = os.getenv("GMAIL_PUSH_TOKEN")
+
+
+def decode_push_data(data: str) -> dict:
+    """
+    Decode the base64 data of a Gmail Pub/Sub notification,
+    e.g. {"emailAddress": "me@example.com", "historyId": 1234}.
+    """
+    padded = data + "=" * (-len(data) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded))
+
+
+async def account_for_address(email_address: str | None) -> str | None:
+    """
+    Map the emailAddress of a notification to the account syncing that mailbox.
+    Addresses are learned by the first full sync; until then a single configured
+    account takes every notification. None if the address is unknown.
+    """
+    if email_address:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(SyncState.id).where(SyncState.email_address == email_address))
+            account_id = result.scalar_one_or_none()
+        if account_id is not None:
+            return account_id
+    if len(GMAIL_ACCOUNTS) == 1:
+        return GMAIL_ACCOUNTS[0]
+    return None
+
+
+class SyncTrigger:
+    """
+    Debounces push notifications of one account into incremental syncs.
+
+    The first notification starts a runner that waits GMAIL_PUSH_DEBOUNCE_SECONDS
+    and then syncs up to the highest pushed history id. Notifications arriving
+    while a sync runs schedule exactly one more sync afterwards.
+    """
+
+    def __init__(self, account_id: str, debounce_seconds: float = GMAIL_PUSH_DEBOUNCE_SECONDS):
+        self.account_id = account_id
+        self.debounce_seconds = debounce_seconds
+        self.last_push_at = None
+        self._history_id = None
+        self._task = None
+
+    def notify(self, history_id: int | None = None):
+        self.last_push_at = datetime.now(timezone.utc)
+        if history_id is not None:
+            self._history_id = max(self._history_id or 0, int(history_id))
+        elif self._history_id is None:
+            # no id given: sync whatever is new
+            self._history_id = 0
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self._history_id is not None:
+            await asyncio.sleep(self.debounce_seconds)
+            history_id, self._history_id = self._history_id, None
+            try:
+                await sync_gmail(self.account_id, until_history_id=history_id or None)
+            except Exception:
+                logger.exception("Push triggered sync failed account=%s", self.account_id)
+
+    def push_active(self, within_seconds: float) -> bool:
+        """
+        True if a notification arrived recently, i.e. the watch is delivering.
+        """
+        if self.last_push_at is None:
+            return False
+        return (datetime.now(timezone.utc) - self.last_push_at).total_seconds() < within_seconds
+
+
+_sync_triggers = {}
+
+
+def get_sync_trigger(account_id: str) -> SyncTrigger:
+    trigger = _sync_triggers.get(account_id)
+    if trigger is None:
+        trigger = _sync_triggers[account_id] = SyncTrigger(account_id)
+    return trigger
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+# Gmail quota units per method, see https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS = {
+    "getProfile": 1,
+    "labels.list": 1,
+    "history.list": 2,
+    "messages.list": 5,
+    "messages.get": 5,
+    "watch": 100,
+}
+
+# Per-user limit is 15'000 units per minute (each account has its own); stay a bit below by default
+GMAIL_QUOTA_UNITS_PER_SECOND = float(os.getenv("GMAIL_QUOTA_UNITS_PER_SECOND", "240"))
+
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_CAP_SECONDS = float(os.getenv("GMAIL_BACKOFF_CAP_SECONDS", "64"))
+
+
+class TokenBucket:
+    """
+    Token bucket shared by all concurrent Gmail callers.
+
+    Tokens are quota units, refilled at `rate` per second up to `capacity`.
+    Waiters are served in FIFO order. Requests larger than the capacity are
+    admitted once the bucket is full and leave it in debt, so they still pay.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, units: float):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self._refill()
+                needed = min(units, self.capacity)
+                if self.tokens >= needed:
+                    self.tokens -= units
+                    return
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+
+    def drain(self):
+        """
+        Empty the bucket after the API signalled we are over quota.
+        """
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+    def pause(self, seconds: float):
+        """
+        Stop handing out tokens for `seconds`, e.g. from a Retry-After header.
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.drain()
+
+
+_buckets = {}
+
+
+def get_bucket(account_id: str) -> TokenBucket:
+    """
+    Token bucket of an account, Gmail enforces the quota per mailbox.
+    """
+    bucket = _buckets.get(account_id)
+    if bucket is None:
+        bucket = _buckets[account_id] = TokenBucket(GMAIL_QUOTA_UNITS_PER_SECOND)
+    return bucket
+
+
+def quota_units(method: str, count: int = 1) -> float:
+    return QUOTA_UNITS.get(method, 5) * count
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Full-jitter exponential backoff: uniform between 0 and min(cap, base * 2^attempt).
+    """
+    return random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def retry_after_seconds(resp) -> float | None:
+    """
+    Parse a Retry-After header given in seconds, None if missing or an HTTP date.
+    """
+    if resp is None:
+        return None
+    value = resp.get("retry-after")
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
@@ -1,278 +1,351 @@
 import asyncio
-import base64
 import logging
 import os
 from datetime import datetime, timezone
-from email.utils import parsedate_to_datetime
-from typing import Optional
 
 from googleapiclient.errors import HttpError
-from sqlalchemy import select
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
 
-from app.gmail.client import GmailClient
+from app.config import DEFAULT_GMAIL_ACCOUNT
+from app.db.locks import AdvisoryLock
 from app.db.session import AsyncSessionLocal
 from app.db.utils import commit_or_rollback
-from app.models.email import Email
-from app.models.label import Label
+from app.gmail.backfill import GMAIL_BACKFILL, backfill_gmail, has_open_windows
+from app.gmail.fetch import gmail_call, get_label_map
+from app.gmail.history import apply_history_changes, coalesce_history, list_history
+from app.gmail.pipeline import SyncPipeline, submit_page
+from app.metrics import SYNC_RUNS
+from app.ml.inference import score_new_emails
+from app.ml.online import update_online_model
+from app.ml.persistence import load_versioned_model
 from app.models.sync_state import SyncState
 
 logger = logging.getLogger(__name__)
 
-MAX_RETRIES = 5
-MAX_CONCURRENT_EMAILS = 10
-
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-
-def safe_parse_date(value: Optional[str]):
-    if not value:
-        return None
+# Accounts syncing at the same time. Further syncs wait in FIFO order, so with
+# many accounts every one gets its turn and none can starve the others.
+GMAIL_SYNC_CONCURRENCY = int(os.getenv("GMAIL_SYNC_CONCURRENCY", "4"))
+_sync_slots = asyncio.Semaphore(GMAIL_SYNC_CONCURRENCY)
+
+# A running sync refreshes SyncState.heartbeat_at this often (seconds);
+# without a beat for GMAIL_SYNC_STALE_SECONDS the status reports it stalled
+GMAIL_SYNC_HEARTBEAT_SECONDS = float(os.getenv("GMAIL_SYNC_HEARTBEAT_SECONDS", "15"))
+GMAIL_SYNC_STALE_SECONDS = float(os.getenv("GMAIL_SYNC_STALE_SECONDS", "60"))
+
+# Score new inbox emails with the active TF-IDF model after every sync
+GMAIL_SYNC_PREDICT = os.getenv("GMAIL_SYNC_PREDICT", "true").lower() in ("1", "true", "yes")
+# Update the online model (app.ml.online) with the changed labels after every sync
+GMAIL_SYNC_ONLINE_LEARNING = os.getenv("GMAIL_SYNC_ONLINE_LEARNING", "true").lower() in ("1", "true", "yes")
+# one scoring run at a time, accounts finishing together would score the same emails
+_scoring = asyncio.Lock()
+
+
+def is_stalled(state: SyncState) -> bool:
+    """
+    True if the sync is marked running but its heartbeat stopped, e.g. the process was killed.
+    The next sync takes over such a state without manual intervention.
+    """
+    if not state.running:
+        return False
+    if state.heartbeat_at is None:
+        return True
+    return (datetime.now(timezone.utc) - state.heartbeat_at).total_seconds() > GMAIL_SYNC_STALE_SECONDS
+
+
+async def _heartbeat(account_id: str):
+    while True:
+        await asyncio.sleep(GMAIL_SYNC_HEARTBEAT_SECONDS)
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(SyncState)
+                    .where(SyncState.id == account_id)
+                    .values(heartbeat_at=datetime.now(timezone.utc))
+                )
+                await commit_or_rollback(
+                    db,
+                    context={"sync_state_id": account_id, "action": "heartbeat"},
+                )
+        except SQLAlchemyError:
+            # a missed beat only shows up as stalled in the status
+            logger.warning("Sync heartbeat failed account=%s", account_id, exc_info=True)
+
+
+async def acquire_sync_lock(db: AsyncSession, account_id: str):
+    """
+    Take the account's advisory lock and mark its SyncState as running.
+    Returns (state, lock), None if another process or replica is syncing the account.
+    """
+    lock = AdvisoryLock(f"gmail_sync:{account_id}")
     try:
-        dt = parsedate_to_datetime(value)
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        return dt
-    except ValueError:
-        logger.warning("Invalid date header value=%r", value)
+        if not await lock.acquire():
+            logger.info("Sync already running account=%s, exiting", account_id)
+            return None
+    except OperationalError:
+        logger.exception("Failed to acquire sync lock")
         return None
 
-
-async def gmail_call(func):
-    for attempt in range(MAX_RETRIES):
-        try:
-            return func()
-        except HttpError as e:
-            status = e.resp.status
-            if status in (429, 500, 503):
-                logger.warning("Gmail API transient error status=%s retry=%s", status, attempt + 1)
-                await asyncio.sleep(2 ** attempt)
-            else:
-                logger.error("Gmail API error status=%s message=%s", status, e)
-                raise
-    raise RuntimeError("Gmail API retry limit exceeded")
-
-
-def get_plain_text(payload):
-    if payload["mimeType"] == "text/plain":
-        data = payload["body"].get("data")
-        if data:
-            return base64.urlsafe_b64decode(data).decode("utf-8")
-    for part in payload.get("parts", []):
-        if part["mimeType"] == "text/plain":
-            data = part["body"].get("data")
-            if data:
-                return base64.urlsafe_b64decode(data).decode("utf-8")
-    return ""
-
-
-async def get_label_map(service: GmailClient):
-    result = await gmail_call(lambda: service.list_labels())
-    return {label["id"]: label["name"] for label in result}
-
-
-async def acquire_sync_lock(db: AsyncSession):
     try:
-        result = await db.execute(select(SyncState).with_for_update())
-        state = result.scalars().first()
-
+        state = await db.get(SyncState, account_id)
         if not state:
-            state = SyncState(id="gmail")
+            state = SyncState(id=account_id)
             db.add(state)
-            await db.flush()
-
-        if state.running:
-            logger.info("Sync already running, exiting")
-            return None
+        elif state.running:
+            # holding the lock proves the previous holder is gone
+            logger.warning(
+                "Taking over sync account=%s, previous run died after heartbeat_at=%s",
+                account_id, state.heartbeat_at,
+            )
 
+        now = datetime.now(timezone.utc)
         state.running = True
-        state.last_started_at = datetime.now(timezone.utc)
+        state.last_started_at = now
+        state.heartbeat_at = now
         state.processed_messages = 0
         state.last_error = None
         await commit_or_rollback(
             db,
             context={"sync_state_id": state.id, "action": "acquire_lock"},
         )
+    except BaseException:
+        await lock.release()
+        raise
 
-        logger.info("Sync started")
-        return state
-
-    except OperationalError:
-        await db.rollback()
-        logger.exception("Failed to acquire sync lock")
-        return None
+    logger.info("Sync started account=%s", account_id)
+    return state, lock
 
 
-async def release_sync_lock(db: AsyncSession, state: SyncState):
-    state.running = False
-    state.last_finished_at = datetime.now(timezone.utc)
+async def release_sync_lock(db: AsyncSession, state: SyncState, lock: AdvisoryLock):
+    try:
+        # processed_messages is advanced by the pipeline writer in its own session
+        await db.refresh(state, ["processed_messages"])
+        state.running = False
+        state.last_finished_at = datetime.now(timezone.utc)
+        await commit_or_rollback(
+            db,
+            context={"sync_state_id": state.id, "action": "release_lock"},
+        )
+    finally:
+        await lock.release()
+    logger.info("Sync finished account=%s processed=%s", state.id, state.processed_messages)
+
+
+async def start_full_sync(db: AsyncSession, state: SyncState):
+    """
+    Remember the mailbox history id before listing starts, unless resuming a full sync.
+    Mail arriving meanwhile is then picked up by the next incremental run.
+    """
+    if state.full_sync_history_id is not None:
+        logger.info("Resuming full sync after listed=%s", state.full_sync_listed)
+        return
+
+    logger.info("Full sync started account=%s", state.id)
+    profile = await gmail_call(lambda client: client.get_profile(), "getProfile", account_id=state.id)
+    state.email_address = profile["emailAddress"]
+    state.full_sync_history_id = profile["historyId"]
+    state.full_sync_page_token = None
+    state.full_sync_listed = 0
     await commit_or_rollback(
         db,
-        context={"sync_state_id": state.id, "action": "release_lock"},
+        context={"sync_state_id": state.id, "action": "start_full_sync"},
     )
-    logger.info("Sync finished processed=%s", state.processed_messages)
 
 
-async def store_message(service: GmailClient, db: AsyncSession, label_map, msg_id):
-    msg = await gmail_call(lambda: service.get_message(msg_id))
+async def finish_full_sync(db: AsyncSession, state: SyncState):
+    """
+    Clear the full sync checkpoint and return the history id to continue from incrementally.
+    """
+    # the checkpoint columns were written by the pipeline's session
+    await db.refresh(state)
+    history_id = state.full_sync_history_id
+    state.full_sync_history_id = None
+    state.full_sync_page_token = None
+    state.full_sync_listed = 0
+    return history_id
+
+
+async def full_sync(label_map, state: SyncState, refresh_known_labels: bool = False):
+    """
+    List the whole mailbox page by page and stream unknown messages through the sync pipeline.
+    Progress is checkpointed per page in SyncState, an interrupted full sync resumes from there.
+    With refresh_known_labels, labels of already stored messages are refreshed too
+    (used when the history id expired and label changes were missed).
+    """
+    async def produce(pipeline: SyncPipeline):
+        next_page_token = state.full_sync_page_token
+        listed = state.full_sync_listed or 0
+        while True:
+            response = await gmail_call(
+                lambda client: client.list_messages(page_token=next_page_token),
+                "messages.list",
+                account_id=state.id,
+            )
 
-    headers = {h["name"]: h["value"] for h in msg["payload"]["headers"]}
+            msg_ids = [m["id"] for m in response.get("messages", [])]
+            listed += len(msg_ids)
+            next_page_token = response.get("nextPageToken")
 
-    email = Email(
-        id=msg["id"],
-        thread_id=msg["threadId"],
-        from_address=headers.get("From"),
-        to_address=headers.get("To", os.getenv("DEFAULT_TO_ADDRESS", "undi@sclos.ed")),
-        subject=headers.get("Subject"),
-        date_sent=safe_parse_date(headers.get("Date")),
-        body=get_plain_text(msg["payload"]),
-    )
-
-    stmt = insert(Email).values(
-        id=email.id,
-        thread_id=email.thread_id,
-        from_address=email.from_address,
-        to_address=email.to_address,
-        subject=email.subject,
-        date_sent=email.date_sent,
-        body=email.body,
-    ).on_conflict_do_update(
-        index_elements=[Email.id],
-        set_={
-            "thread_id": email.thread_id,
-            "from_address": email.from_address,
-            "to_address": email.to_address,
-            "subject": email.subject,
-            "date_sent": email.date_sent,
-            "body": email.body,
-        },
-    )
+            values = {"full_sync_listed": listed}
+            if next_page_token:
+                # the last page keeps the previous token, resuming re-lists just that page
+                values["full_sync_page_token"] = next_page_token
+            checkpoint = update(SyncState).where(SyncState.id == state.id).values(**values)
+            await submit_page(pipeline, msg_ids, checkpoint, refresh_known_labels)
 
-    await db.execute(stmt)
+            if not next_page_token:
+                break
 
-    for label_id in msg.get("labelIds", []):
-        label_name = label_map.get(label_id, label_id)
-        stmt = insert(Label).values(
-            id=f"{msg_id}:{label_name}",
-            name=label_name,
-            email_id=email.id,
-        ).on_conflict_do_nothing()
-        await db.execute(stmt)
+    await SyncPipeline(label_map, state.id).run(produce)
 
-    logger.debug("Stored message id=%s", msg_id)
 
+async def incremental_sync(label_map, state: SyncState):
+    """
+    Apply all changes since state.history_id.
+    Deletions and label-only changes go straight to the database, new messages through the pipeline.
+    Raises HttpError 404 if the history id expired.
+    """
+    logger.info("Incremental sync account=%s from history_id=%s", state.id, state.history_id)
+    records, history_id = await list_history(state.history_id, account_id=state.id)
+    changes = coalesce_history(records)
 
-async def store_message_batch(service: GmailClient, db: AsyncSession, label_map, msg_ids):
-    sem = asyncio.Semaphore(MAX_CONCURRENT_EMAILS)
+    if changes.deleted or changes.labels:
+        async with AsyncSessionLocal() as db:
+            await apply_history_changes(db, changes, label_map, state.id)
+            await commit_or_rollback(
+                db,
+                context={"sync_state_id": state.id, "action": "apply_history_changes"},
+            )
 
-    async def safe_store(mid):
-        async with sem:
-            await store_message(service, db, label_map, mid)
+    async def produce(pipeline: SyncPipeline):
+        if changes.added:
+            await pipeline.submit(sorted(changes.added))
 
-    await asyncio.gather(*(safe_store(mid) for mid in msg_ids))
+    await SyncPipeline(label_map, state.id).run(produce)
+    return history_id
 
 
-async def sync_gmail():
+async def is_synced_up_to(history_id, account_id: str = DEFAULT_GMAIL_ACCOUNT) -> bool:
+    """
+    True if the account's stored history id already covers history_id (e.g. from a push notification).
+    """
     async with AsyncSessionLocal() as db:
-        state = await acquire_sync_lock(db)
-        if state is None:
+        result = await db.execute(select(SyncState.history_id).where(SyncState.id == account_id))
+        stored = result.scalar_one_or_none()
+    return stored is not None and int(stored) >= int(history_id)
+
+
+async def sync_gmail(
+    account_id: str = DEFAULT_GMAIL_ACCOUNT,
+    backfill: bool = GMAIL_BACKFILL,
+    until_history_id=None,
+    predict: bool = GMAIL_SYNC_PREDICT,
+    learn: bool = GMAIL_SYNC_ONLINE_LEARNING,
+):
+    """
+    Run one sync of an account: incremental from the stored history id, or a full sync.
+    At most GMAIL_SYNC_CONCURRENCY accounts sync at the same time, the call waits for a free slot.
+    Afterwards the online model learns the changes and the new inbox emails are scored,
+    see GMAIL_SYNC_ONLINE_LEARNING and GMAIL_SYNC_PREDICT.
+
+    :param account_id: account to sync, see GMAIL_ACCOUNTS
+    :param backfill: do a full sync as a parallel, date-partitioned backfill
+    :param until_history_id: pushed history id, the sync is skipped without any Gmail call if already covered
+    :param predict: score the new inbox emails afterwards
+    :param learn: update the online model with the label changes afterwards
+    :return: the history id synced up to, None if nothing ran
+    """
+    async with _sync_slots:
+        if until_history_id is not None and await is_synced_up_to(until_history_id, account_id):
+            logger.debug("Already synced account=%s up to history_id=%s, skipping", account_id, until_history_id)
+            return None
+        history_id = await _sync_account(account_id, backfill)
+    if learn and history_id is not None:
+        await _update_online_model()
+    if predict and history_id is not None:
+        await _score_new_emails()
+    return history_id
+
+
+async def _update_online_model():
+    """
+    Learn the label changes of the sync. Best effort, an error never fails the sync.
+    """
+    try:
+        async with AsyncSessionLocal() as db:
+            await update_online_model(db)
+    except Exception:
+        logger.exception("Updating the online model failed")
+
+
+async def _score_new_emails():
+    """
+    Store predictions for the emails the sync added. Best effort, a missing
+    model or a scoring error never fails the sync.
+    """
+    async with _scoring:
+        try:
+            version, (vectorizer, clf) = await asyncio.to_thread(load_versioned_model)
+        except FileNotFoundError:
+            logger.debug("No active model, skipping scoring")
             return
-
         try:
-            service = GmailClient()
-            label_map = await get_label_map(service)
-
-            if state.history_id is None:
-                # Full sync
-                logger.info("Full sync started")
-                next_page_token = None
-                while True:
-                    response = await gmail_call(
-                        lambda: service.list_messages(page_token=next_page_token)
-                    )
-
-                    msg_ids = [m["id"] for m in response.get("messages", [])]
-                    if msg_ids:
-                        await store_message_batch(service, db, label_map, msg_ids)
-                        state.processed_messages += len(msg_ids)
-
-                    try:
-                        await commit_or_rollback(
-                            db,
-                            context={"sync_state_id": state.id, "action": "batch_store_messages"},
-                        )
-                    except IntegrityError as e:
-                        orig = e.orig  # asyncpg exception
-
-                        logger.error(
-                            "IntegrityError while persisting email" + [ [m["id"],m["subject"], m["to"]] for m in response.get("messages", [])],
-                            exc_info=True,
-                            extra={
-                                "account_id": account_id,
-                                "history_id": history_id,
-                                "gmail_id": email.gmail_id,
-                                "constraint": getattr(orig, "constraint_name", None),
-                                "column": getattr(orig, "column_name", None),
-                                "detail": getattr(orig, "detail", None),
-                            },
-                        )
-                        raise
+            async with AsyncSessionLocal() as db:
+                await score_new_emails(db, version, vectorizer, clf)
+        except Exception:
+            logger.exception("Scoring new emails failed model_version=%s", version)
 
 
+async def _sync_account(account_id: str, backfill: bool):
+    async with AsyncSessionLocal() as db:
+        acquired = await acquire_sync_lock(db, account_id)
+        if acquired is None:
+            return None
+        state, lock = acquired
+        heartbeat = asyncio.create_task(_heartbeat(account_id))
 
-                    state.history_id = response.get("historyId")
-                    await commit_or_rollback(
-                        db,
-                        context={"sync_state_id": state.id, "action": "update_history_id"},
-                    )
+        try:
+            label_map = await get_label_map(account_id)
 
-                    next_page_token = response.get("nextPageToken")
-                    if not next_page_token:
-                        break
-            else:
-                # Incremental sync
-                logger.info("Incremental sync from history_id=%s", state.history_id)
+            history_id = None
+            history_expired = False
+            if state.history_id is not None and state.full_sync_history_id is None:
                 try:
-                    response = await gmail_call(
-                        lambda: service.get_history(start_history_id=state.history_id)
-                    )
+                    history_id = await incremental_sync(label_map, state)
                 except HttpError as e:
-                    if e.resp.status == 404:
-                        logger.warning("HistoryId expired, falling back to full sync")
-                        state.history_id = None
-                        await commit_or_rollback(
-                            db,
-                            context={"sync_state_id": state.id, "action": "reset_history_id"},
-                        )
-                        return await sync_gmail()
-                    raise
-
-                for h in response.get("history", []):
-                    msg_ids = [added["message"]["id"] for added in h.get("messagesAdded", [])]
-                    if msg_ids:
-                        await store_message_batch(service, db, label_map, msg_ids)
-                        state.processed_messages += len(msg_ids)
-
-                    await commit_or_rollback(
-                        db,
-                        context={"sync_state_id": state.id, "action": "batch_store_messages"},
-                    )
-                    if h.get("id"):
-                        state.history_id = h["id"]
-                        await commit_or_rollback(
-                            db,
-                            context={"sync_state_id": state.id, "action": "update_history_id"},
-                        )
+                    if e.resp.status != 404:
+                        raise
+                    logger.warning("HistoryId expired account=%s, falling back to full sync", account_id)
+                    history_expired = True
+
+            if history_id is None:
+                await start_full_sync(db, state)
+                if backfill or await has_open_windows(state.id):
+                    await backfill_gmail(label_map, state, refresh_known_labels=history_expired)
+                else:
+                    await full_sync(label_map, state, refresh_known_labels=history_expired)
+                history_id = await finish_full_sync(db, state)
+
+            state.history_id = history_id
+            await commit_or_rollback(
+                db,
+                context={"sync_state_id": state.id, "action": "update_history_id"},
+            )
+            SYNC_RUNS.labels(account_id, "ok").inc()
+            return history_id
 
         except Exception as e:
+            SYNC_RUNS.labels(account_id, "error").inc()
             state.last_error = str(e)
             await commit_or_rollback(
                 db,
                 context={"sync_state_id": state.id, "action": "record_error"},
             )
-            logger.exception("Sync failed")
+            logger.exception("Sync failed account=%s", account_id)
             raise
         finally:
-            await release_sync_lock(db, state)
+            heartbeat.cancel()
+            await release_sync_lock(db, state, lock)
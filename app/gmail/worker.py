@@ -4,12 +4,19 @@ from datetime import datetime, timezone
 import os
 import signal
 
-from app.gmail.sync import sync_gmail
+from app.config import GMAIL_ACCOUNTS
+from app.gmail.fetch import gmail_call
+from app.gmail.push import GMAIL_PUSH_TOKEN, GMAIL_PUSH_TOPIC, get_sync_trigger
+from app.gmail.sync import GMAIL_SYNC_CONCURRENCY, sync_gmail
 
 logger = logging.getLogger(__name__)
 
 # Configurable interval from environment (seconds)
 SYNC_INTERVAL_SECONDS = int(os.getenv("GMAIL_SYNC_INTERVAL", "60"))
+# Idle polls double the interval up to this (seconds); with working push this is the fallback rate
+SYNC_MAX_INTERVAL_SECONDS = int(os.getenv("GMAIL_SYNC_MAX_INTERVAL", "900"))
+# users.watch expires after 7 days, renew daily
+WATCH_RENEW_SECONDS = 24 * 60 * 60
 
 # Global event to signal shutdown
 _stop_event = asyncio.Event()
@@ -20,32 +27,119 @@ def _signal_handler(*args):
     _stop_event.set()
 
 
-async def gmail_worker():
+def stop_gmail_worker():
+    _stop_event.set()
+
+
+async def _run_sync_until_stopped(account_id: str):
     """
-    Continuous Gmail sync worker.
-    Runs in background, periodically triggers sync_gmail().
-    Stops gracefully when _stop_event is set.
+    Run one sync of an account, cancelling it when shutdown is requested.
+    A cancelled full sync resumes from its last committed page checkpoint.
+    Returns the history id synced up to, None if nothing ran.
     """
-    logger.info("Starting continuous Gmail worker with interval=%s seconds", SYNC_INTERVAL_SECONDS)
+    sync_task = asyncio.create_task(sync_gmail(account_id))
+    stop_task = asyncio.create_task(_stop_event.wait())
+    await asyncio.wait({sync_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+    stop_task.cancel()
+
+    if not sync_task.done():
+        logger.info("Cancelling running Gmail sync account=%s", account_id)
+        sync_task.cancel()
+
+    try:
+        return await sync_task
+    except asyncio.CancelledError:
+        logger.info("Gmail sync account=%s cancelled, it resumes on next start", account_id)
+    except Exception as e:
+        logger.exception("Gmail sync account=%s encountered an error: %s", account_id, e)
+    return None
+
+
+async def _renew_watch(account_id: str):
+    try:
+        response = await gmail_call(
+            lambda client: client.watch(GMAIL_PUSH_TOPIC), "watch", account_id=account_id
+        )
+        logger.info(
+            "Gmail watch renewed account=%s topic=%s expiration=%s",
+            account_id, GMAIL_PUSH_TOPIC, response.get("expiration"),
+        )
+    except Exception:
+        logger.exception("Failed to renew Gmail watch account=%s, relying on polling", account_id)
+
+
+def next_interval(account_id: str, interval: float, changed: bool) -> float:
+    """
+    Adaptive polling: back to the base interval after changes, double it while idle.
+    While push notifications arrive, polling stays at the maximum as a safety net.
+    """
+    if get_sync_trigger(account_id).push_active(within_seconds=SYNC_MAX_INTERVAL_SECONDS * 2):
+        return SYNC_MAX_INTERVAL_SECONDS
+    if changed:
+        return SYNC_INTERVAL_SECONDS
+    return min(interval * 2, SYNC_MAX_INTERVAL_SECONDS)
+
 
-    # Register signal handlers once
-    loop = asyncio.get_running_loop()
-    for sig in (signal.SIGINT, signal.SIGTERM):
-        loop.add_signal_handler(sig, _signal_handler)
+async def _account_loop(account_id: str):
+    """
+    Poll one account with its own adaptive interval until the worker is stopped.
+    """
+    interval = SYNC_INTERVAL_SECONDS
+    last_history_id = None
+    watch_renewed_at = None
 
     while not _stop_event.is_set():
         start_time = datetime.now(timezone.utc)
-        try:
-            await sync_gmail()
-        except Exception as e:
-            logger.exception("Gmail sync encountered an error: %s", e)
+
+        if GMAIL_PUSH_TOPIC and (
+            watch_renewed_at is None or (start_time - watch_renewed_at).total_seconds() > WATCH_RENEW_SECONDS
+        ):
+            await _renew_watch(account_id)
+            watch_renewed_at = start_time
+
+        # waits for a free sync slot, see GMAIL_SYNC_CONCURRENCY
+        history_id = await _run_sync_until_stopped(account_id)
+        changed = history_id is not None and history_id != last_history_id
+        last_history_id = history_id or last_history_id
+        interval = next_interval(account_id, interval, changed)
 
         # Sleep until next iteration or until shutdown
         elapsed = (datetime.now(timezone.utc) - start_time).total_seconds()
-        sleep_time = max(0, SYNC_INTERVAL_SECONDS - elapsed)
+        sleep_time = max(0, interval - elapsed)
+        logger.debug("Next Gmail poll account=%s in %.0f seconds", account_id, sleep_time)
         try:
             await asyncio.wait_for(_stop_event.wait(), timeout=sleep_time)
         except asyncio.TimeoutError:
             continue  # timeout expired, run next iteration
 
+
+async def gmail_worker(install_signal_handlers: bool = True, accounts=None):
+    """
+    Continuous Gmail sync worker for all accounts.
+    Every account is polled with its own adaptive interval, the syncs share
+    GMAIL_SYNC_CONCURRENCY slots that are handed out first come, first served.
+    Renews the Gmail push watch of every account if GMAIL_PUSH_TOPIC is set.
+    Stops gracefully when _stop_event is set.
+
+    :param install_signal_handlers: False when embedded in a server that handles signals itself
+    :param accounts: account ids to sync, defaults to GMAIL_ACCOUNTS
+    """
+    accounts = accounts or GMAIL_ACCOUNTS
+    logger.info(
+        "Starting continuous Gmail worker accounts=%s concurrency=%s interval=%s seconds",
+        len(accounts), GMAIL_SYNC_CONCURRENCY, SYNC_INTERVAL_SECONDS,
+    )
+    if GMAIL_PUSH_TOPIC and not GMAIL_PUSH_TOKEN:
+        logger.warning("GMAIL_PUSH_TOPIC is set without GMAIL_PUSH_TOKEN, push notifications will be refused")
+
+    if install_signal_handlers:
+        # Register signal handlers once
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, _signal_handler)
+
+    async with asyncio.TaskGroup() as tg:
+        for account_id in accounts:
+            tg.create_task(_account_loop(account_id))
+
     logger.info("Gmail worker stopped gracefully")
@@ -1,21 +1,51 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
 from app.routers import emails
 from app.logging_config import setup_logging
 from app.middleware.server import ServerHeaderMiddleware
+from app.middleware.metrics import MetricsMiddleware
+from app.gmail.worker import gmail_worker, stop_gmail_worker
 from app.routers import sync
 from app.routers import ml
+from app.routers import metrics
+from app.routers import search
 from app.routers.admin import db as admin_db
+from app.routers.admin import export as admin_export
 from fastapi import FastAPI
 
 
 setup_logging()
 
+# Run the continuous Gmail worker inside the app process
+GMAIL_WORKER_ENABLED = os.getenv("GMAIL_WORKER_ENABLED", "false").lower() in ("1", "true", "yes")
 
-app = FastAPI(title="Life Terminal", swagger_ui_parameters={"syntaxHighlight": {"theme": "monokai"}})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    worker_task = None
+    if GMAIL_WORKER_ENABLED:
+        # uvicorn owns the signal handlers, the worker is stopped below instead
+        worker_task = asyncio.create_task(gmail_worker(install_signal_handlers=False))
+    yield
+    if worker_task is not None:
+        stop_gmail_worker()
+        await worker_task
+
+
+app = FastAPI(
+    title="Life Terminal",
+    swagger_ui_parameters={"syntaxHighlight": {"theme": "monokai"}},
+    lifespan=lifespan,
+)
 app.add_middleware(ServerHeaderMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 # include routers
 app.include_router(sync.router)
 app.include_router(ml.router)
 app.include_router(admin_db.router)
-app.include_router(emails.router)
\ No newline at end of file
+app.include_router(admin_export.router)
+app.include_router(emails.router)
+app.include_router(metrics.router)
+app.include_router(search.router)
\ No newline at end of file
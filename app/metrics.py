@@ -0,0 +1,40 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Exposed in Prometheus text format on GET /metrics, see app/routers/metrics.py
+
+# Gmail API
+GMAIL_CALLS = Counter(
+    "gmail_api_calls_total", "Gmail API call attempts by outcome (ok, error, retry)", ["method", "outcome"]
+)
+GMAIL_CALL_SECONDS = Histogram(
+    "gmail_api_call_seconds", "Latency of one Gmail API call attempt, batch calls included", ["method"]
+)
+GMAIL_RETRIES = Counter(
+    "gmail_api_retries_total", "Retried Gmail API calls by HTTP status, 'network' for connection errors",
+    ["method", "status"],
+)
+GMAIL_QUOTA_WAIT_SECONDS = Histogram(
+    "gmail_quota_wait_seconds", "Time spent waiting for quota units in the token bucket", ["method"]
+)
+
+# Sync pipeline
+SYNC_MESSAGES = Counter("sync_messages_written_total", "Messages committed by the sync pipeline", ["account"])
+SYNC_MESSAGES_PER_SECOND = Gauge(
+    "sync_messages_per_second", "Throughput of the last finished sync pipeline run", ["account"]
+)
+SYNC_STAGE_SECONDS = Histogram(
+    "sync_stage_seconds", "Time per chunk in a sync pipeline stage (fetch, parse, write)", ["stage"]
+)
+SYNC_QUEUE_DEPTH = Gauge("sync_queue_depth", "Items waiting in a sync pipeline queue", ["account", "queue"])
+SYNC_RUNS = Counter("sync_runs_total", "Finished syncs by outcome (ok, error)", ["account", "outcome"])
+
+# Database
+DB_COMMITS = Counter("db_commits_total", "Commits by action and outcome (ok, rollback)", ["action", "outcome"])
+DB_COMMIT_SECONDS = Histogram("db_commit_seconds", "Latency of commit_or_rollback", ["action"])
+
+# HTTP, covers the ML endpoints
+HTTP_REQUESTS = Counter("http_requests_total", "Handled requests", ["method", "route", "status"])
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "Request latency by route", ["method", "route"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900),
+)
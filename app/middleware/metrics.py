@@ -0,0 +1,21 @@
+import time
+from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi import Request
+
+from app.metrics import HTTP_REQUEST_SECONDS, HTTP_REQUESTS
+
+
+class MetricsMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        started = time.monotonic()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            # the route template keeps the label set small, unmatched paths are grouped
+            route = request.scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            HTTP_REQUESTS.labels(request.method, path, str(status)).inc()
+            HTTP_REQUEST_SECONDS.labels(request.method, path).observe(time.monotonic() - started)
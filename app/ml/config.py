@@ -11,4 +11,29 @@ MODEL_DIR = "models/tfidf"
 
 CONFIDENCE_THRESHOLD = 0.2
 
-TRAINING_TEST_SPLIT = 0.2
\ No newline at end of file
+TRAINING_TEST_SPLIT = 0.2
+# Rows per server-side cursor fetch of the ML loaders
+STREAM_CHUNK_SIZE = 1000
+
+# Versions kept per kind in MODEL_DIR/versions, the active one is never removed
+MODEL_KEEP_VERSIONS = 5
+
+# Best classes stored with every prediction
+PREDICTION_TOP_K = 3
+
+# Analyzed training documents, see app.ml.features
+FEATURE_CACHE_DIR = "models/feature_cache"
+
+# Online model, see app.ml.online
+ONLINE_MODEL_DIR = "models/online"
+ONLINE_HASH_FEATURES = 2 ** 18
+# seconds between checkpoints
+ONLINE_CHECKPOINT_SECONDS = 3600
+# label changes younger than this are left for the next update, their transactions may still be open
+ONLINE_SETTLE_SECONDS = 60
+
+# Embeddings of the RoBERTa experiment, see app.ml.embeddings
+EMBEDDING_MODEL = "distilroberta-base"
+# EMBEDDING_MODEL = "roberta-base" # better model performance / training takes 160% of time
+EMBEDDING_MAX_LENGTH = 256
+EMBEDDING_CACHE_DIR = "models/embeddings"
@@ -2,52 +2,68 @@
 from collections import Counter
 import numpy as np
 from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+from app.db.bodies import decompress_body
+from app.db.labels import email_label_names
 from app.db.session import AsyncSessionLocal
+from app.db.utils import stream_chunks
+from app.ml.config import STREAM_CHUNK_SIZE
 from app.models.email import Email
-from app.models.label import Label
+from app.models.email_body import EmailBody
+from app.models.label import LabelName
 
-async def fetch_labeled_emails():
+async def iter_labeled_emails(chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yield (texts, label_lists) per chunk of emails with a label besides INBOX.
+    """
+    stmt = (
+        select(Email.subject, EmailBody.data.label("body"), email_label_names().label("labels"))
+        .outerjoin(EmailBody, Email.body_hash == EmailBody.hash)
+        .where(Email.labels.any(LabelName.name != "INBOX"))
+    )
     async with AsyncSessionLocal() as session:
-        stmt = (
-            select(Email)
-            .options(selectinload(Email.labels))
-            .where(Email.labels.any())
-            .where(Email.labels.any(Label.name != "INBOX"))
-        )
-        result = await session.execute(stmt)
-        return result.scalars().unique().all()
-
-def build_label_vocab(emails, min_count=10):
+        async for chunk in stream_chunks(session, stmt, chunk_size):
+            texts = [f"{r.subject or ''}\n\n{decompress_body(r.body) or ''}" for r in chunk]
+            yield texts, [r.labels for r in chunk]
+
+async def fetch_labeled_emails():
+    """
+    Texts and label name lists of all labeled emails, built chunk by chunk from a server-side cursor.
+    """
+    texts, label_lists = [], []
+    async for chunk_texts, chunk_labels in iter_labeled_emails():
+        texts.extend(chunk_texts)
+        label_lists.extend(chunk_labels)
+    return texts, label_lists
+
+def build_label_vocab(label_lists, min_count=10):
     counter = Counter()
-    for email in emails:
-        for label in email.labels:
-            if label.name != "INBOX":
-                counter[label.name] += 1
+    for names in label_lists:
+        for name in names:
+            if name != "INBOX":
+                counter[name] += 1
 
     labels = sorted(name for name, count in counter.items() if count >= min_count)
     label2id = {label: i for i, label in enumerate(labels)}
     id2label = {i: label for label, i in label2id.items()}
     return label2id, id2label
 
-def email_to_multihot(email, label2id):
+def email_to_multihot(names, label2id):
     y = np.zeros(len(label2id), dtype=np.float32)
-    for label in email.labels:
-        if label.name in label2id:
-            y[label2id[label.name]] = 1.0
+    for name in names:
+        if name in label2id:
+            y[label2id[name]] = 1.0
     return y
 
 
-def prepare_training_data(emails, label2id):
-    texts = []
+def prepare_training_data(texts, label_lists, label2id):
+    kept_texts = []
     targets = []
 
-    for email in emails:
-        text = f"{email.subject or ''}\n\n{email.body or ''}"
-        y = email_to_multihot(email, label2id)
+    for text, names in zip(texts, label_lists):
+        y = email_to_multihot(names, label2id)
         if y.sum() == 0:
             continue
-        texts.append(text)
+        kept_texts.append(text)
         targets.append(y)
 
-    return texts, np.vstack(targets)
+    return kept_texts, np.vstack(targets)
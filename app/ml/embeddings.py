@@ -0,0 +1,173 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+
+from app.ml.config import EMBEDDING_CACHE_DIR, EMBEDDING_MAX_LENGTH, EMBEDDING_MODEL, STREAM_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Transformer embeddings of texts, persisted across experiments. An embedding only
+# depends on the text and the encoder, so rows are keyed by a hash of the text in a
+# directory per encoder configuration and computed once. Rows are appended to a raw
+# float16 matrix read through np.memmap, with the text hashes in a parallel file.
+
+# bytes of the blake2b text hash
+_HASH_SIZE = 16
+# half the size of float32, the precision loss is far below what a linear classifier notices
+_DTYPE = np.dtype("<f2")
+
+_lock = threading.Lock()
+_stores = {}
+
+
+def _text_hash(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=_HASH_SIZE).digest()
+
+
+def _encoder_key(model_name: str, max_length: int) -> str:
+    config = {"model": model_name, "max_length": max_length, "pooling": "mean"}
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+@lru_cache(maxsize=None)
+def _load_encoder(model_name: str):
+    """
+    Tokenizer and model, loaded once per process.
+    """
+    # imported here, the TF-IDF and online models are used from the sync path without torch
+    from transformers import AutoModel, AutoTokenizer
+
+    logger.info("Loading encoder", extra={"model": model_name})
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    return tokenizer, model
+
+
+def _encode(texts: list[str], model_name: str, max_length: int, batch_size: int) -> np.ndarray:
+    import torch
+
+    tokenizer, model = _load_encoder(model_name)
+    embeddings = []
+    with torch.no_grad():
+        for start in range(0, len(texts), batch_size):
+            encoded = tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=max_length,
+                return_tensors="pt",
+            )
+            last_hidden = model(**encoded).last_hidden_state
+
+            # mean pooling
+            mask = encoded["attention_mask"].unsqueeze(-1)
+            pooled = (last_hidden * mask).sum(1) / mask.sum(1)
+            embeddings.append(pooled.cpu().numpy())
+    return np.vstack(embeddings)
+
+
+class EmbeddingStore:
+    """
+    Embedding rows keyed by text hash for one encoder configuration. Append only,
+    the texts of stored emails do not change, so the store grows with the corpus.
+    """
+
+    def __init__(self, key: str):
+        self.dir = Path(EMBEDDING_CACHE_DIR) / key
+        self.vectors_path = self.dir / "vectors.f16"
+        self.hashes_path = self.dir / "hashes.bin"
+        self.meta_path = self.dir / "meta.json"
+        self.dim = None
+        self.rows = {}
+        self.vectors = np.empty((0, 0), dtype=_DTYPE)
+
+    @classmethod
+    def open(cls, key: str, meta: dict) -> "EmbeddingStore":
+        store = cls(key)
+        try:
+            store.dim = json.loads(store.meta_path.read_text()).get("dim")
+        except FileNotFoundError:
+            store.dir.mkdir(parents=True, exist_ok=True)
+            store.meta_path.write_text(json.dumps(meta, indent=2))
+            return store
+        if store.dim is None:
+            # nothing was appended yet
+            return store
+
+        store.vectors_path.touch()
+        store.hashes_path.touch()
+        row_bytes = store.dim * _DTYPE.itemsize
+        n = min(store.hashes_path.stat().st_size // _HASH_SIZE, store.vectors_path.stat().st_size // row_bytes)
+        # drop the tail of an append that was interrupted, both files have to stay aligned
+        os.truncate(store.vectors_path, n * row_bytes)
+        os.truncate(store.hashes_path, n * _HASH_SIZE)
+
+        hashes = store.hashes_path.read_bytes()
+        store.rows = {hashes[i * _HASH_SIZE:(i + 1) * _HASH_SIZE]: i for i in range(n)}
+        store._map()
+        return store
+
+    def _map(self):
+        n = len(self.rows)
+        if n:
+            self.vectors = np.memmap(self.vectors_path, dtype=_DTYPE, mode="r", shape=(n, self.dim))
+
+    def append(self, text_hashes: list[bytes], embeddings: np.ndarray):
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+            meta = json.loads(self.meta_path.read_text())
+            self.meta_path.write_text(json.dumps({**meta, "dim": self.dim}, indent=2))
+        # vectors first, a crash leaves rows without hash that the next open drops
+        with open(self.vectors_path, "ab") as f:
+            f.write(np.ascontiguousarray(embeddings, dtype=_DTYPE).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.hashes_path, "ab") as f:
+            f.write(b"".join(text_hashes))
+        for text_hash in text_hashes:
+            self.rows[text_hash] = len(self.rows)
+        self._map()
+
+
+def _get_store(model_name: str, max_length: int) -> EmbeddingStore:
+    key = _encoder_key(model_name, max_length)
+    store = _stores.get(key)
+    if store is None:
+        store = _stores[key] = EmbeddingStore.open(key, {"model": model_name, "max_length": max_length})
+    return store
+
+
+def embed_texts(texts, model_name: str = EMBEDDING_MODEL, max_length: int = EMBEDDING_MAX_LENGTH, batch_size: int = 8):
+    """
+    Mean-pooled embeddings as float32, texts can be any iterable and is consumed chunk by chunk.
+    Only texts missing from the embedding store are encoded, and are added to it.
+    """
+    texts = iter(texts)
+    embeddings = []
+    computed = 0
+    with _lock:
+        store = _get_store(model_name, max_length)
+        while chunk := list(islice(texts, STREAM_CHUNK_SIZE)):
+            hashes = [_text_hash(text) for text in chunk]
+            # dict, so texts repeated within the chunk are encoded once
+            missing = {h: text for h, text in zip(hashes, chunk) if h not in store.rows}
+            if missing:
+                store.append(list(missing), _encode(list(missing.values()), model_name, max_length, batch_size))
+                computed += len(missing)
+            embeddings.append(np.asarray(store.vectors[[store.rows[h] for h in hashes]], dtype=np.float32))
+
+    if not embeddings:
+        raise ValueError("No texts to embed")
+    logger.info(
+        "Embedded texts",
+        extra={"model": model_name, "texts": sum(len(e) for e in embeddings), "computed": computed},
+    )
+    return np.vstack(embeddings)
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import logging
+import os
+import uuid
+from numbers import Integral
+from pathlib import Path
+
+import numpy as np
+import scipy.sparse as sp
+import sklearn
+from sklearn.feature_extraction.text import TfidfTransformer
+
+from app.ml.config import FEATURE_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Term counts of analyzed documents, persisted across training runs. Tokenizing,
+# n-gram building and stop word removal are independent of the rest of the corpus,
+# so a document only has to be analyzed again when its text or the analyzer
+# configuration changes. Vocabulary limits and idf are corpus-wide and are always
+# recomputed from the cached counts, which is cheap.
+
+# TfidfVectorizer parameters that change the output of build_analyzer()
+_ANALYZER_PARAMS = (
+    "analyzer", "decode_error", "encoding", "input", "lowercase", "ngram_range",
+    "preprocessor", "stop_words", "strip_accents", "token_pattern", "tokenizer",
+)
+# analyzer output never contains it, the terms are stored as one joined string
+_TERM_SEPARATOR = "\0"
+# bytes of the blake2b text hash
+_HASH_SIZE = 16
+
+
+def _text_hash(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=_HASH_SIZE).digest()
+
+
+def analyzer_key(vectorizer) -> str | None:
+    """
+    Stable key of the analyzer configuration, None if it cannot be cached (custom callables).
+    """
+    params = vectorizer.get_params()
+    if any(callable(params[name]) for name in ("analyzer", "preprocessor", "tokenizer")):
+        return None
+    config = {name: params[name] for name in _ANALYZER_PARAMS}
+    if config["stop_words"] is not None and not isinstance(config["stop_words"], str):
+        config["stop_words"] = sorted(config["stop_words"])
+    # analyzers may change between scikit-learn releases
+    config["sklearn"] = sklearn.__version__
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class FeatureCache:
+    """
+    Term count rows keyed by text hash for one analyzer configuration, stored as CSR
+    over a sorted term dictionary. Documents not used by a run are dropped on save once
+    they outnumber the used ones, so the file stays around the corpus size.
+    """
+
+    def __init__(self, key: str):
+        self.path = Path(FEATURE_CACHE_DIR) / f"{key}.npz"
+        self.terms = []
+        self._term_ids = None
+        self.hashes = []
+        self.rows = {}
+        self.matrix = sp.csr_matrix((0, 0), dtype=np.int64)
+        self._new_rows = []
+        self._used = set()
+
+    @classmethod
+    def load(cls, key: str) -> "FeatureCache":
+        cache = cls(key)
+        try:
+            # plain arrays, unpickling millions of term strings would cost more than analyzing
+            with np.load(cache.path, allow_pickle=False) as stored:
+                terms = stored["terms"].tobytes().decode("utf-8")
+                cache.terms = terms.split(_TERM_SEPARATOR) if terms else []
+                hashes = stored["hashes"].tobytes()
+                cache.hashes = [hashes[i:i + _HASH_SIZE] for i in range(0, len(hashes), _HASH_SIZE)]
+                cache.matrix = sp.csr_matrix(
+                    (stored["data"], stored["indices"], stored["indptr"]),
+                    shape=(len(cache.hashes), len(cache.terms)),
+                )
+        except FileNotFoundError:
+            return cache
+        except Exception:
+            logger.warning("Unreadable feature cache, starting empty", exc_info=True, extra={"path": str(cache.path)})
+            return cls(key)
+        cache.rows = {h: i for i, h in enumerate(cache.hashes)}
+        return cache
+
+    @property
+    def term_ids(self):
+        # only needed to analyze new documents, built on first use
+        if self._term_ids is None:
+            self._term_ids = {term: i for i, term in enumerate(self.terms)}
+        return self._term_ids
+
+    def _add(self, text_hash: bytes, text: str, analyze) -> int:
+        term_ids = self.term_ids
+        counts = {}
+        for term in analyze(text):
+            term_id = term_ids.get(term)
+            if term_id is None:
+                term_id = term_ids[term] = len(self.terms)
+                self.terms.append(term)
+            counts[term_id] = counts.get(term_id, 0) + 1
+        row = len(self.hashes)
+        self.hashes.append(text_hash)
+        self.rows[text_hash] = row
+        self._new_rows.append((np.fromiter(counts.keys(), np.int64), np.fromiter(counts.values(), np.int64)))
+        return row
+
+    def _flush_new_rows(self):
+        if not self._new_rows:
+            return
+        indptr = np.cumsum([0] + [len(indices) for indices, _ in self._new_rows])
+        new = sp.csr_matrix(
+            (np.concatenate([data for _, data in self._new_rows]),
+             np.concatenate([indices for indices, _ in self._new_rows]),
+             indptr),
+            shape=(len(self._new_rows), len(self.terms)),
+        )
+        sorted_terms = self.matrix.shape[1]
+        old = sp.csr_matrix(self.matrix, shape=(self.matrix.shape[0], len(self.terms)))
+        self.matrix = sp.vstack([old, new], format="csr")
+        self._new_rows = []
+        if len(self.terms) > sorted_terms:
+            self._sort_terms()
+
+    def _sort_terms(self):
+        # kept in term order, so column order is the sorted feature order of CountVectorizer
+        # indices are sorted, a fixed-width numpy str array would be sized by the longest term
+        terms = self.terms
+        order = np.array(sorted(range(len(terms)), key=terms.__getitem__), dtype=np.int64)
+        remap = np.empty(len(order), dtype=np.int64)
+        remap[order] = np.arange(len(order))
+        self.terms = [terms[i] for i in order]
+        self._term_ids = None
+        self.matrix.indices = remap[self.matrix.indices]
+        self.matrix.has_sorted_indices = False
+
+    def counts(self, texts, analyze):
+        """
+        Term counts of texts over self.terms, only texts missing from the cache are analyzed.
+
+        :return: (csr matrix with a row per text, number of newly analyzed texts)
+        """
+        rows = []
+        added = 0
+        for text in texts:
+            text_hash = _text_hash(text)
+            row = self.rows.get(text_hash)
+            if row is None:
+                row = self._add(text_hash, text, analyze)
+                added += 1
+            rows.append(row)
+        self._flush_new_rows()
+        self._used.update(rows)
+        return self.matrix[rows], added
+
+    def save(self):
+        matrix, hashes, terms = self.matrix, self.hashes, self.terms
+        if len(self._used) < len(hashes) - len(self._used):
+            keep = np.array(sorted(self._used))
+            matrix = matrix[keep]
+            hashes = [hashes[i] for i in keep]
+            used_terms = np.flatnonzero(np.bincount(matrix.indices, minlength=len(terms)))
+            remap = np.full(len(terms), -1, dtype=np.int64)
+            remap[used_terms] = np.arange(len(used_terms))
+            matrix = sp.csr_matrix(
+                (matrix.data, remap[matrix.indices], matrix.indptr), shape=(len(hashes), len(used_terms)),
+            )
+            terms = [terms[i] for i in used_terms]
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{uuid.uuid4().hex}")
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                terms=np.frombuffer(_TERM_SEPARATOR.join(terms).encode("utf-8"), dtype=np.uint8),
+                hashes=np.frombuffer(b"".join(hashes), dtype=np.uint8),
+                indptr=matrix.indptr,
+                indices=matrix.indices.astype(np.int32),
+                data=matrix.data.astype(np.int32),
+            )
+        os.replace(tmp, self.path)
+
+
+def _limit_vocabulary(vectorizer, X, terms):
+    """
+    Vocabulary and count matrix like CountVectorizer.fit_transform: features sorted by
+    term, then pruned by max_df/min_df and max_features with the same tie-breaking.
+
+    :param terms: sorted terms of the columns of X
+    """
+    used = np.flatnonzero(np.bincount(X.indices, minlength=len(terms)))
+    remap = np.empty(len(terms), dtype=np.int64)
+    remap[used] = np.arange(len(used))
+    X = sp.csr_matrix((X.data, remap[X.indices], X.indptr), shape=(X.shape[0], len(used)))
+    X.sort_indices()
+
+    n_doc = X.shape[0]
+    max_df, min_df = vectorizer.max_df, vectorizer.min_df
+    high = max_df if isinstance(max_df, Integral) else max_df * n_doc
+    low = min_df if isinstance(min_df, Integral) else min_df * n_doc
+    if high < low:
+        raise ValueError("max_df corresponds to < documents than min_df")
+
+    dfs = np.bincount(X.indices, minlength=X.shape[1])
+    mask = (dfs <= high) & (dfs >= low)
+    limit = vectorizer.max_features
+    if limit is not None and mask.sum() > limit:
+        tfs = np.asarray(X.sum(axis=0)).ravel()
+        mask_inds = (-tfs[mask]).argsort()[:limit]
+        new_mask = np.zeros(len(dfs), dtype=bool)
+        new_mask[np.where(mask)[0][mask_inds]] = True
+        mask = new_mask
+
+    kept = np.where(mask)[0]
+    if len(kept) == 0:
+        raise ValueError("After pruning, no terms remain. Try a lower min_df or a higher max_df.")
+    return {terms[used[i]]: new for new, i in enumerate(kept)}, X[:, kept]
+
+
+def fit_tfidf(vectorizer, texts):
+    """
+    Same as vectorizer.fit_transform(texts), with the analyzed documents taken from
+    the feature cache. Falls back to fit_transform for configurations it cannot cache.
+    """
+    key = analyzer_key(vectorizer)
+    if key is None or vectorizer.vocabulary is not None or not vectorizer.use_idf or vectorizer.binary:
+        return vectorizer.fit_transform(texts)
+
+    cache = FeatureCache.load(key)
+    counts, added = cache.counts(texts, vectorizer.build_analyzer())
+    if not counts.nnz:
+        raise ValueError("empty vocabulary; perhaps the documents only contain stop words")
+    if added:
+        cache.save()
+    logger.info("Vectorized documents", extra={"documents": counts.shape[0], "analyzed": added})
+
+    vocabulary, X = _limit_vocabulary(vectorizer, counts, cache.terms)
+    X = X.astype(vectorizer.dtype)
+    transformer = TfidfTransformer(
+        norm=vectorizer.norm,
+        use_idf=vectorizer.use_idf,
+        smooth_idf=vectorizer.smooth_idf,
+        sublinear_tf=vectorizer.sublinear_tf,
+    ).fit(X)
+    vectorizer.vocabulary_ = vocabulary
+    # the idf_ setter creates the fitted transformer that vectorizer.transform uses
+    vectorizer.idf_ = transformer.idf_
+    return transformer.transform(X, copy=False)
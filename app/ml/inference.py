@@ -1,42 +1,147 @@
+import asyncio
+import logging
+
 import numpy as np
-from sqlalchemy import select
+from sqlalchemy import delete, exists, select
+from sqlalchemy.dialects.postgresql import insert
 
+from app.db.bodies import decompress_body
+from app.db.session import AsyncSessionLocal
+from app.db.utils import commit_or_rollback, stream_chunks
 from app.models.email import Email
-from app.models.label import Label
-from app.ml.config import CONFIDENCE_THRESHOLD
+from app.models.email_body import EmailBody
+from app.models.label import EmailLabel, LabelName
+from app.models.prediction import Prediction
+from app.ml.config import CONFIDENCE_THRESHOLD, PREDICTION_TOP_K, STREAM_CHUNK_SIZE
+from app.ml.persistence import list_models
 
+logger = logging.getLogger(__name__)
 
-async def load_inbox_emails(db):
-    stmt = (
-        select(Email.id, Email.subject, Email.body)
-        .join(Label)
-        .where(Label.name == "INBOX")
-    )
 
-    rows = (await db.execute(stmt)).all()
+def _inbox_filter():
+    # resolved once, the join itself runs on the integer label id
+    inbox_id = select(LabelName.id).where(LabelName.name == "INBOX").scalar_subquery()
+    return exists().where(EmailLabel.email_id == Email.id).where(EmailLabel.label_id == inbox_id)
 
-    texts = [
-        f"{r.subject or ''}\n{r.body or ''}"
-        for r in rows
-    ]
 
-    return rows, texts
+async def iter_inbox_emails(db, chunk_size=STREAM_CHUNK_SIZE, unscored_for: str | None = None):
+    """
+    Yield (rows, texts) per chunk of inbox emails, rows carry id and subject.
 
+    :param unscored_for: only emails without a prediction of this model version
+    """
+    stmt = (
+        select(Email.id, Email.subject, EmailBody.data.label("body"))
+        .outerjoin(EmailBody, Email.body_hash == EmailBody.hash)
+        .where(_inbox_filter())
+    )
+    if unscored_for is not None:
+        stmt = stmt.where(
+            ~exists()
+            .where(Prediction.email_id == Email.id)
+            .where(Prediction.model_version == unscored_for)
+        )
 
-def predict_labels(vectorizer, clf, texts):
+    async for chunk in stream_chunks(db, stmt, chunk_size):
+        rows = [(r.id, r.subject) for r in chunk]
+        texts = [
+            f"{r.subject or ''}\n{decompress_body(r.body) or ''}"
+            for r in chunk
+        ]
+        yield rows, texts
+
+
+def score_texts(vectorizer, clf, texts, top_k=PREDICTION_TOP_K):
+    """
+    (label, score, top_k) per text, label is NEEDS_NEW_LABEL if the best score is below
+    CONFIDENCE_THRESHOLD, top_k lists the best classes as {"label", "score"}.
+    """
     X = vectorizer.transform(texts)
     scores = clf.decision_function(X)
+    if scores.ndim == 1:
+        # binary classifiers return the score of classes_[1] only
+        scores = np.column_stack([-scores, scores])
     labels = clf.classes_
 
     results = []
 
     for row_scores in scores:
-        best_idx = int(np.argmax(row_scores))
-        best_score = row_scores[best_idx]
-
-        if best_score < CONFIDENCE_THRESHOLD:
-            results.append("NEEDS_NEW_LABEL")
-        else:
-            results.append(labels[best_idx])
+        order = np.argsort(row_scores)[::-1][:top_k]
+        best_idx = int(order[0])
+        best_score = float(row_scores[best_idx])
+        label = "NEEDS_NEW_LABEL" if best_score < CONFIDENCE_THRESHOLD else str(labels[best_idx])
+        results.append((label, best_score, [{"label": str(labels[i]), "score": float(row_scores[i])} for i in order]))
 
     return results
+
+
+def predict_labels(vectorizer, clf, texts):
+    return [label for label, _, _ in score_texts(vectorizer, clf, texts)]
+
+
+async def delete_pruned_predictions(db) -> int:
+    """
+    Delete the predictions of model versions no longer in the registry, the caller commits.
+    Every version adds a row per inbox email, so without this the table grows with each training run.
+
+    :return: number of deleted predictions
+    """
+    versions = [meta["version"] for meta in list_models()]
+    if not versions:
+        # no registry on this host, nothing to compare against
+        return 0
+    result = await db.execute(delete(Prediction).where(Prediction.model_version.not_in(versions)))
+    if result.rowcount:
+        logger.info("Deleted predictions of pruned model versions", extra={"predictions": result.rowcount})
+    return result.rowcount
+
+
+async def score_new_emails(db, version: str, vectorizer, clf) -> int:
+    """
+    Predict and store labels for inbox emails without a prediction of this model version.
+    The work grows with new mail, not with the inbox. Every chunk is committed on db
+    while the rows are read in a separate session. Predictions of pruned versions are
+    deleted first, see delete_pruned_predictions.
+
+    :return: number of emails scored
+    """
+    await delete_pruned_predictions(db)
+    await commit_or_rollback(db, context={"action": "delete_pruned_predictions"})
+
+    scored = 0
+    async with AsyncSessionLocal() as reader:
+        async for rows, texts in iter_inbox_emails(reader, unscored_for=version):
+            results = await asyncio.to_thread(score_texts, vectorizer, clf, texts)
+            await db.execute(
+                insert(Prediction)
+                .values([
+                    {"email_id": email_id, "model_version": version, "label": label, "score": score, "top_k": top_k}
+                    for (email_id, _), (label, score, top_k) in zip(rows, results)
+                ])
+                .on_conflict_do_nothing(index_elements=["email_id", "model_version"])
+            )
+            await commit_or_rollback(db, context={"action": "store_predictions", "model_version": version})
+            scored += len(rows)
+    if scored:
+        logger.info("Scored new emails", extra={"model_version": version, "emails": scored})
+    return scored
+
+
+async def load_predictions(db, version: str, after: str | None = None, limit: int | None = None):
+    """
+    Stored (email id, subject, label) of the inbox for a model version, ordered by email id.
+
+    :param after: only emails with a larger id, the last id of the previous page
+    :param limit: at most this many rows
+    """
+    stmt = (
+        select(Email.id, Email.subject, Prediction.label)
+        .join(Prediction, Prediction.email_id == Email.id)
+        .where(Prediction.model_version == version)
+        .where(_inbox_filter())
+        .order_by(Email.id)
+        .limit(limit)
+    )
+    if after is not None:
+        stmt = stmt.where(Email.id > after)
+    return (await db.execute(stmt)).tuples().all()
@@ -0,0 +1,156 @@
+import asyncio
+import copy
+import logging
+import os
+import time
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+import joblib
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from sqlalchemy import func, select
+
+from app.ml.config import (
+    ONLINE_CHECKPOINT_SECONDS,
+    ONLINE_HASH_FEATURES,
+    ONLINE_MODEL_DIR,
+    ONLINE_SETTLE_SECONDS,
+    SEMANTIC_LABELS,
+)
+from app.ml.persistence import save_model
+from app.ml.training import iter_training_data
+from app.ml.utils import get_stopwords
+
+logger = logging.getLogger(__name__)
+
+# Online variant of the TF-IDF + LinearSVC model: a stateless HashingVectorizer and an
+# SGDClassifier updated with partial_fit on the emails whose labels changed since the
+# last update (Email.labels_changed_at), typically right after a sync.
+#
+# The model lives in memory and is checkpointed to ONLINE_MODEL_DIR together with its
+# watermark. After a crash the updates since the last checkpoint are replayed from the
+# database. publish_online_model stores a snapshot in the model registry, from where it is
+# served like any other version. Checkpoints never publish, every published version is
+# scored on the whole inbox.
+
+CHECKPOINT_FILE = Path(ONLINE_MODEL_DIR) / "checkpoint.joblib"
+
+_lock = asyncio.Lock()
+_model = None
+
+
+class OnlineModel:
+    """
+    :param watermark: labels_changed_at up to which emails have been learned, None before the first update
+    """
+
+    def __init__(self, vectorizer=None, clf=None, watermark=None, trained: int = 0):
+        self.vectorizer = vectorizer or HashingVectorizer(
+            n_features=ONLINE_HASH_FEATURES,
+            ngram_range=(1, 2),
+            stop_words=get_stopwords(),
+            alternate_sign=False,
+        )
+        self.clf = clf or SGDClassifier(loss="hinge", alpha=1e-5, random_state=42)
+        self.watermark = watermark
+        self.trained = trained
+        self.checkpointed_at = time.monotonic()
+
+    @property
+    def fitted(self) -> bool:
+        return hasattr(self.clf, "classes_")
+
+    def partial_fit(self, texts, labels):
+        X = self.vectorizer.transform(texts)
+        # all classes have to be known on the first call
+        self.clf.partial_fit(X, labels, classes=None if self.fitted else np.array(SEMANTIC_LABELS))
+        self.trained += len(labels)
+
+
+def _load_checkpoint() -> OnlineModel:
+    try:
+        stored = joblib.load(CHECKPOINT_FILE)
+    except FileNotFoundError:
+        return OnlineModel()
+    model = OnlineModel(stored["vectorizer"], stored["clf"], stored["watermark"], stored["trained"])
+    if model.fitted and sorted(model.clf.classes_) != sorted(SEMANTIC_LABELS):
+        logger.warning("SEMANTIC_LABELS changed, starting a new online model")
+        return OnlineModel()
+    return model
+
+
+def _save_checkpoint(model: OnlineModel):
+    CHECKPOINT_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = CHECKPOINT_FILE.with_name(f".{CHECKPOINT_FILE.name}.{uuid.uuid4().hex}")
+    joblib.dump(
+        {"vectorizer": model.vectorizer, "clf": model.clf, "watermark": model.watermark, "trained": model.trained},
+        tmp,
+    )
+    os.replace(tmp, CHECKPOINT_FILE)
+    model.checkpointed_at = time.monotonic()
+
+
+async def _get_model() -> OnlineModel:
+    global _model
+    if _model is None:
+        _model = await asyncio.to_thread(_load_checkpoint)
+    return _model
+
+
+def _publish(model: OnlineModel) -> str:
+    # a copy, the registry caches the objects it serves and partial_fit keeps changing these
+    version = save_model(copy.deepcopy(model.vectorizer), copy.deepcopy(model.clf), kind="online")
+    logger.info("Published online model", extra={"version": version, "trained": model.trained})
+    return version
+
+
+async def update_online_model(db, checkpoint: bool = False) -> int:
+    """
+    partial_fit the online model on emails whose labels changed since its watermark.
+    The first update learns all labeled emails, streamed chunk by chunk.
+
+    :param checkpoint: checkpoint now instead of after ONLINE_CHECKPOINT_SECONDS
+    :return: number of (email, label) samples learned
+    """
+    async with _lock:
+        model = await _get_model()
+        # database clock, the same one that sets labels_changed_at
+        until = (await db.execute(select(func.now() - timedelta(seconds=ONLINE_SETTLE_SECONDS)))).scalar_one()
+        learned = 0
+        async for texts, labels in iter_training_data(db, changed_after=model.watermark, changed_until=until):
+            await asyncio.to_thread(model.partial_fit, texts, labels)
+            learned += len(labels)
+        first_update = model.watermark is None
+        model.watermark = until
+
+        if learned:
+            logger.info("Updated online model", extra={"samples": learned, "trained": model.trained})
+        due = time.monotonic() - model.checkpointed_at >= ONLINE_CHECKPOINT_SECONDS
+        if checkpoint or first_update or (learned and due):
+            await asyncio.to_thread(_save_checkpoint, model)
+        return learned
+
+
+async def publish_online_model() -> str:
+    """
+    Checkpoint the online model and make a snapshot of it the active registry version.
+    """
+    async with _lock:
+        model = await _get_model()
+        if not model.fitted:
+            raise ValueError("The online model has not learned anything yet")
+        await asyncio.to_thread(_save_checkpoint, model)
+        return await asyncio.to_thread(_publish, model)
+
+
+async def online_model_status() -> dict:
+    model = await _get_model()
+    return {
+        "fitted": model.fitted,
+        "trained": model.trained,
+        "watermark": model.watermark,
+        "checkpoint_age_seconds": round(time.monotonic() - model.checkpointed_at, 1),
+    }
@@ -1,16 +1,166 @@
-import joblib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime, timezone
 from pathlib import Path
-from app.ml.config import MODEL_DIR
 
+import joblib
+from app.ml.config import MODEL_DIR, MODEL_KEEP_VERSIONS
+
+logger = logging.getLogger(__name__)
+
+# Versioned registry of the TF-IDF + LinearSVC pipeline:
+#
+#   MODEL_DIR/versions/<version>/{vectorizer,classifier}.joblib + meta.json
+#   MODEL_DIR/ACTIVE  name of the version load_model serves
+#
+# Versions are written to a temporary directory and renamed into place, ACTIVE is
+# replaced atomically, so readers never see a half written model. load_model keeps
+# the active model in memory and reloads it when ACTIVE changes, also when another
+# process promoted a version.
+
+VERSIONS_DIR = Path(MODEL_DIR) / "versions"
+ACTIVE_FILE = Path(MODEL_DIR) / "ACTIVE"
+
+_lock = threading.RLock()
+# (ACTIVE stat key, version, (vectorizer, clf)) of the cached model
+_cache = None
+
+
+def _active_key():
+    # os.replace gives ACTIVE a new inode on every promotion
+    stat = ACTIVE_FILE.stat()
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _new_version() -> str:
+    return f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex[:6]}"
+
+
+def active_version() -> str | None:
+    try:
+        return ACTIVE_FILE.read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def list_models() -> list[dict]:
+    """
+    Metadata of all stored versions, newest first.
+    """
+    if not VERSIONS_DIR.is_dir():
+        return []
+    models = []
+    for path in VERSIONS_DIR.iterdir():
+        meta_file = path / "meta.json"
+        if path.name.startswith(".") or not meta_file.is_file():
+            continue
+        models.append(json.loads(meta_file.read_text()))
+    return sorted(models, key=lambda meta: meta["created_at"], reverse=True)
+
+
+def promote_model(version: str) -> None:
+    """
+    Make version the active model, processes serving load_model pick it up on their next call.
+    """
+    if "/" in version or version.startswith(".") or not (VERSIONS_DIR / version / "meta.json").is_file():
+        raise FileNotFoundError(f"Unknown model version {version!r}")
+    tmp = ACTIVE_FILE.with_name(f".ACTIVE.{uuid.uuid4().hex}")
+    tmp.write_text(version)
+    os.replace(tmp, ACTIVE_FILE)
+    logger.info("Promoted model", extra={"version": version})
+
+
+def _prune_versions(kind: str) -> None:
+    # per kind, online publishes never push trained TF-IDF versions out
+    active = active_version()
+    versions = [meta for meta in list_models() if meta.get("kind", "tfidf") == kind]
+    for meta in versions[MODEL_KEEP_VERSIONS:]:
+        if meta["version"] != active:
+            shutil.rmtree(VERSIONS_DIR / meta["version"], ignore_errors=True)
+
+
+def save_model(vectorizer, clf, promote: bool = True, kind: str = "tfidf") -> str:
+    """
+    Store a trained pipeline as a new version.
+
+    :param promote: make it the active model right away
+    :param kind: "tfidf" for TfidfVectorizer + LinearSVC, "online" for app.ml.online checkpoints
+    :return: the version name
+    """
+    version = _new_version()
+    VERSIONS_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = VERSIONS_DIR / f".{version}"
+    tmp.mkdir()
+    joblib.dump(vectorizer, tmp / "vectorizer.joblib")
+    joblib.dump(clf, tmp / "classifier.joblib")
+    meta = {
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "kind": kind,
+        "features": len(vectorizer.vocabulary_) if hasattr(vectorizer, "vocabulary_") else vectorizer.n_features,
+        "classes": [str(c) for c in clf.classes_],
+    }
+    (tmp / "meta.json").write_text(json.dumps(meta, indent=2))
+    os.rename(tmp, VERSIONS_DIR / version)
+
+    if promote:
+        promote_model(version)
+        global _cache
+        with _lock:
+            # this process already has the objects, no need to read them back
+            _cache = (_active_key(), version, (vectorizer, clf))
+    _prune_versions(kind)
+    return version
+
+
+def _adopt_legacy_model() -> bool:
+    """
+    Register the unversioned MODEL_DIR/*.joblib files of older releases as the first version.
+    """
+    legacy = Path(MODEL_DIR)
+    if not (legacy / "vectorizer.joblib").is_file() or not (legacy / "classifier.joblib").is_file():
+        return False
+    version = save_model(joblib.load(legacy / "vectorizer.joblib"), joblib.load(legacy / "classifier.joblib"))
+    logger.info("Registered legacy model", extra={"version": version})
+    return True
+
+
+def load_versioned_model():
+    """
+    The active (version, (vectorizer, clf)), served from memory. Costs one stat() of
+    ACTIVE per call, the artifacts are only deserialized after a promotion.
+    """
+    global _cache
+    try:
+        key = _active_key()
+    except FileNotFoundError:
+        with _lock:
+            adopted = not ACTIVE_FILE.exists() and _adopt_legacy_model()
+        if not adopted and not ACTIVE_FILE.exists():
+            raise FileNotFoundError(f"No active model in {MODEL_DIR}, train one first") from None
+        key = _active_key()
 
-def save_model(vectorizer, clf):
-    Path(MODEL_DIR).mkdir(parents=True, exist_ok=True)
+    cache = _cache
+    if cache is not None and cache[0] == key:
+        return cache[1], cache[2]
 
-    joblib.dump(vectorizer, f"{MODEL_DIR}/vectorizer.joblib")
-    joblib.dump(clf, f"{MODEL_DIR}/classifier.joblib")
+    with _lock:
+        if _cache is not None and _cache[0] == key:
+            return _cache[1], _cache[2]
+        version = active_version()
+        path = VERSIONS_DIR / version
+        model = joblib.load(path / "vectorizer.joblib"), joblib.load(path / "classifier.joblib")
+        _cache = (key, version, model)
+        logger.info("Loaded model", extra={"version": version})
+        return version, model
 
 
 def load_model():
-    vectorizer = joblib.load(f"{MODEL_DIR}/vectorizer.joblib")
-    clf = joblib.load(f"{MODEL_DIR}/classifier.joblib")
-    return vectorizer, clf
+    """
+    The active (vectorizer, clf), see load_versioned_model.
+    """
+    return load_versioned_model()[1]
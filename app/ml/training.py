@@ -1,9 +1,15 @@
+import asyncio
+
 import numpy as np
-import torch
-from app.ml.config import SEMANTIC_LABELS
+from app.ml.config import SEMANTIC_LABELS, STREAM_CHUNK_SIZE
+from app.ml.embeddings import embed_texts
+from app.ml.features import fit_tfidf
 from app.ml.utils import get_stopwords
+from app.db.bodies import decompress_body
+from app.db.utils import stream_chunks
 from app.models.email import Email
-from app.models.label import Label
+from app.models.email_body import EmailBody
+from app.models.label import EmailLabel, LabelName
 from sqlalchemy import select
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.svm import LinearSVC
@@ -13,61 +19,57 @@ from sklearn.metrics import (
     confusion_matrix,
 )
 
-from transformers import AutoTokenizer, AutoModel
-
 
 def roberta_embeddings(texts, batch_size=8):
-    tokenizer = AutoTokenizer.from_pretrained("distilroberta-base")
-    # tokenizer = AutoTokenizer.from_pretrained("roberta-base") # better model performance / training takes 160% of time
-    model = AutoModel.from_pretrained("distilroberta-base")
-    # model = AutoModel.from_pretrained("roberta-base")
-    model.eval()
-
-    all_embeddings = []
-
-    with torch.no_grad():
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
-            encoded = tokenizer(
-                batch,
-                padding=True,
-                truncation=True,
-                max_length=256,
-                return_tensors="pt",
-            )
-
-            output = model(**encoded)
-            last_hidden = output.last_hidden_state
-
-            # mean pooling
-            mask = encoded["attention_mask"].unsqueeze(-1)
-            pooled = (last_hidden * mask).sum(1) / mask.sum(1)
+    """
+    Mean-pooled embeddings, texts can be any iterable and is consumed chunk by chunk.
+    Texts embedded in earlier runs come from the embedding store.
+    """
+    return embed_texts(texts, batch_size=batch_size)
 
-            all_embeddings.append(pooled.cpu().numpy())
 
-    return np.vstack(all_embeddings)
+async def iter_training_data(db, chunk_size=STREAM_CHUNK_SIZE, changed_after=None, changed_until=None):
+    """
+    Yield (texts, labels) per chunk of emails carrying one of SEMANTIC_LABELS.
 
-
-
-async def load_training_data(db):
+    :param changed_after: only emails whose labels changed after this time
+    :param changed_until: only emails whose labels changed up to this time
+    """
     stmt = (
         select(
             Email.subject,
-            Email.body,
-            Label.name.label("label"),
+            EmailBody.data.label("body"),
+            LabelName.name.label("label"),
         )
-        .join(Label)
-        .where(Label.name.in_(SEMANTIC_LABELS))
+        .join(EmailLabel, EmailLabel.email_id == Email.id)
+        .join(LabelName, LabelName.id == EmailLabel.label_id)
+        .outerjoin(EmailBody, Email.body_hash == EmailBody.hash)
+        .where(LabelName.name.in_(SEMANTIC_LABELS))
     )
+    if changed_after is not None:
+        stmt = stmt.where(Email.labels_changed_at > changed_after)
+    if changed_until is not None:
+        stmt = stmt.where(Email.labels_changed_at <= changed_until)
 
-    rows = (await db.execute(stmt)).all()
+    async for chunk in stream_chunks(db, stmt, chunk_size):
+        texts = [
+            f"{r.subject or ''}\n{decompress_body(r.body) or ''}"
+            for r in chunk
+        ]
+        labels = [r.label for r in chunk]
+        yield texts, labels
 
-    texts = [
-        f"{r.subject or ''}\n{r.body or ''}"
-        for r in rows
-    ]
-    labels = [r.label for r in rows]
 
+async def load_training_data(db):
+    """
+    All training texts and labels, only the decoded texts are kept, never the rows.
+    For the evaluation endpoints, a stratified split needs the whole corpus. Training
+    alone streams, see train_model_from_db.
+    """
+    texts, labels = [], []
+    async for chunk_texts, chunk_labels in iter_training_data(db):
+        texts.extend(chunk_texts)
+        labels.extend(chunk_labels)
     return texts, labels
 
 
@@ -83,13 +85,52 @@ def train_model(texts_train, labels_train):
         max_df=0.9,
     )
 
-    X_train = vectorizer.fit_transform(texts_train)
+    # documents analyzed in earlier runs come from the feature cache
+    X_train = fit_tfidf(vectorizer, texts_train)
 
     clf = LinearSVC(class_weight="balanced")
     clf.fit(X_train, labels_train)
 
     return vectorizer, clf
 
+
+def train_model_chunks(chunks):
+    """
+    train_model on an iterable of (texts, labels) chunks. The texts are vectorized as they
+    arrive, only the sparse term counts of the corpus are held, never all texts.
+    """
+    labels = []
+
+    def texts():
+        for chunk_texts, chunk_labels in chunks:
+            labels.extend(chunk_labels)
+            yield from chunk_texts
+
+    # texts is consumed completely by the vectorizer before the classifier reads labels
+    return train_model(texts(), labels)
+
+
+async def train_model_from_db(db):
+    """
+    train_model on all training data, streamed from the database into the vectorizer
+    running in a worker thread.
+    """
+    loop = asyncio.get_running_loop()
+    chunks = iter_training_data(db)
+
+    def blocking_chunks():
+        # the cursor stays on the event loop, the thread waits for one chunk at a time
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(anext(chunks), loop).result()
+            except StopAsyncIteration:
+                return
+
+    try:
+        return await asyncio.to_thread(train_model_chunks, blocking_chunks())
+    finally:
+        await chunks.aclose()
+
 def evaluate_model(vectorizer, clf, texts_test, labels_test):
     X_test = vectorizer.transform(texts_test)
     preds = clf.predict(X_test)
@@ -1,5 +1,8 @@
 from .email import Email
-from .label import Label
+from .email_body import EmailBody
+from .label import EmailLabel, LabelName
 from .sync_state import SyncState
+from .backfill_window import BackfillWindow
+from .prediction import Prediction
 
-__all__ = ["Email", "Label", "SyncState"]
+__all__ = ["Email", "EmailBody", "LabelName", "EmailLabel", "SyncState", "BackfillWindow", "Prediction"]
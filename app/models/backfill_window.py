@@ -0,0 +1,35 @@
+from sqlalchemy import (
+    Column,
+    Index,
+    String,
+    DateTime,
+    Text,
+    Integer,
+    ForeignKey,
+)
+from app.db.base import Base
+
+
+class BackfillWindow(Base):
+    """
+    Date range of the mailbox listed by one backfill worker, with its own resume point.
+    """
+    __tablename__ = "backfill_windows"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    sync_state_id = Column(
+        String,
+        ForeignKey("sync_state.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    after = Column(DateTime(timezone=True), nullable=False)
+    before = Column(DateTime(timezone=True), nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending / done / failed
+    page_token = Column(String)
+    listed = Column(Integer, default=0)
+    last_error = Column(Text)
+    finished_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        Index("ix_backfill_windows_state_status", "sync_state_id", "status"),
+    )
@@ -2,26 +2,45 @@ from sqlalchemy import (
     Column,
     String,
     DateTime,
-    Text,
+    ForeignKey,
     Index,
+    func,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred, relationship
 from app.db.base import Base
+from app.db.bodies import decompress_body
 
 
 class Email(Base):
     __tablename__ = "emails"
 
     id = Column(String, primary_key=True)
+    # SyncState.id of the mailbox the message was synced from
+    account_id = Column(String, nullable=False, index=True)
     thread_id = Column(String, index=True)
     from_address = Column(String, nullable=False)
     to_address = Column(String, nullable=False)
     subject = Column(String)
-    body = Column(Text)
+    body_hash = Column(String(64), ForeignKey("email_bodies.hash"), index=True)
     date_sent = Column(DateTime(timezone=True), index=True)
+    # set on insert and whenever the sync changes its SEMANTIC_LABELS, drives app.ml.online
+    labels_changed_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), index=True)
+    # subject + body in english and german, written by app.db.search.update_search_vectors
+    search_vector = deferred(Column(TSVECTOR))
 
-    labels = relationship("Label", back_populates="email", cascade="all, delete-orphan")
+    # read only, label rows are written in bulk and removed with the email via ON DELETE CASCADE
+    labels = relationship("LabelName", secondary="email_labels", viewonly=True)
+    # bodies live in email_bodies and are only loaded on request, e.g. selectinload(Email.body_blob)
+    body_blob = relationship("EmailBody", lazy="raise")
 
     __table_args__ = (
         Index("ix_emails_thread_date", "thread_id", "date_sent"),
-    )
\ No newline at end of file
+        Index("ix_emails_search_vector", "search_vector", postgresql_using="gin"),
+    )
+
+    @property
+    def body(self):
+        if "body_blob" not in self.__dict__ or self.body_blob is None:
+            return None
+        return decompress_body(self.body_blob.data)
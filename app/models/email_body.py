@@ -0,0 +1,19 @@
+from sqlalchemy import (
+    Column,
+    String,
+    Integer,
+    LargeBinary,
+)
+from app.db.base import Base
+
+
+class EmailBody(Base):
+    """
+    zlib-compressed body text, content-addressed by the sha256 of the text.
+    Identical bodies (newsletters, notifications) are stored once.
+    """
+    __tablename__ = "email_bodies"
+
+    hash = Column(String(64), primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    size = Column(Integer, nullable=False)  # length of the uncompressed text
@@ -2,32 +2,34 @@ from sqlalchemy import (
     Column,
     Index,
     String,
-    DateTime,
-    Text,
-    Boolean,
     Integer,
     ForeignKey,)
-from sqlalchemy.orm import relationship
 from app.db.base import Base
 
 
 
-class Label(Base):
-    __tablename__ = "labels"
+class LabelName(Base):
+    """
+    Dictionary of label names, email_labels references them by integer id.
+    """
+    __tablename__ = "label_names"
 
-    id = Column(String, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, nullable=False, unique=True)
+
+
+class EmailLabel(Base):
+    __tablename__ = "email_labels"
 
     email_id = Column(
         String,
         ForeignKey("emails.id", ondelete="CASCADE"),
-        index=True,
-        nullable=False,
+        primary_key=True,
     )
-    name = Column(String, index=True)
-
-    email = relationship("Email", back_populates="labels")
+    label_id = Column(Integer, ForeignKey("label_names.id"), primary_key=True)
 
 
     __table_args__ = (
-        Index("ix_labels_email_id", "email_id", "name"),
-    )
\ No newline at end of file
+        # emails by label, e.g. the INBOX join; the primary key serves labels by email
+        Index("ix_email_labels_label_email", "label_id", "email_id"),
+    )
@@ -0,0 +1,30 @@
+from sqlalchemy import (
+    Column,
+    Index,
+    String,
+    Float,
+    DateTime,
+    ForeignKey,
+    func,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from app.db.base import Base
+
+
+class Prediction(Base):
+    """
+    Label predicted for an email by one TF-IDF model version, see app.ml.inference.score_new_emails.
+    """
+    __tablename__ = "predictions"
+
+    email_id = Column(String, ForeignKey("emails.id", ondelete="CASCADE"), primary_key=True)
+    model_version = Column(String, primary_key=True)  # app.ml.persistence version name
+    label = Column(String, nullable=False)  # NEEDS_NEW_LABEL below CONFIDENCE_THRESHOLD
+    score = Column(Float, nullable=False)  # decision function value of the best class
+    top_k = Column(JSONB, nullable=False)  # [{"label", "score"}], best first
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        # reads and the "not yet scored" check go by model version
+        Index("ix_predictions_version_email", "model_version", "email_id"),
+    )
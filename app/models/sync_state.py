@@ -13,14 +13,22 @@ from app.db.base import Base
 class SyncState(Base):
     __tablename__ = "sync_state"
 
-    id = Column(String, primary_key=True)
+    id = Column(String, primary_key=True)  # the account id, one row per synced mailbox
+    email_address = Column(String, unique=True)
     history_id = Column(String)
+    # informational, exclusion is the advisory lock held by the running sync (see app.gmail.sync)
     running = Column(Boolean, default=False)
+    heartbeat_at = Column(DateTime(timezone=True))
     last_started_at = Column(DateTime(timezone=True))
     last_finished_at = Column(DateTime(timezone=True))
     processed_messages = Column(Integer, default=0)
     last_error = Column(Text)
 
+    # full sync checkpoint: listing resumes from full_sync_page_token after a crash
+    full_sync_page_token = Column(String)
+    full_sync_history_id = Column(String)
+    full_sync_listed = Column(Integer, default=0)
+
     __table_args__ = (
         Index("ix_sync_state_history_id", "history_id"),
     )
\ No newline at end of file
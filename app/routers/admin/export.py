@@ -0,0 +1,88 @@
+import asyncio
+import json
+import logging
+from datetime import datetime
+
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import StreamingResponse
+from pydantic import SecretStr
+
+from app.db.bodies import decompress_body
+from app.db.export import iter_email_chunks
+from app.ml.inference import predict_labels
+from app.ml.persistence import load_model
+from app.routers.admin.db import check_api_key
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/admin/export",
+    tags=["admin"],
+)
+
+
+def _decompress_bodies(chunk):
+    return [decompress_body(r.body) for r in chunk]
+
+
+async def _ndjson(chunks, with_body: bool, model):
+    async for chunk in chunks:
+        if with_body or model is not None:
+            bodies = await asyncio.to_thread(_decompress_bodies, chunk)
+        else:
+            bodies = [None] * len(chunk)
+        predictions = [None] * len(chunk)
+        if model is not None:
+            texts = [f"{r.subject or ''}\n{body or ''}" for r, body in zip(chunk, bodies)]
+            predictions = await asyncio.to_thread(predict_labels, *model, texts)
+
+        lines = []
+        for r, body, prediction in zip(chunk, bodies, predictions):
+            record = {
+                "id": r.id,
+                "account_id": r.account_id,
+                "thread_id": r.thread_id,
+                "from_address": r.from_address,
+                "to_address": r.to_address,
+                "subject": r.subject,
+                "date_sent": r.date_sent.isoformat() if r.date_sent else None,
+                "labels": sorted(r.labels or []),
+            }
+            if with_body:
+                record["body"] = body
+            if model is not None:
+                record["predicted_label"] = str(prediction)
+            lines.append(json.dumps(record, ensure_ascii=False))
+        yield "\n".join(lines) + "\n"
+
+
+@router.get(
+    "/emails",
+    summary="Stream emails with labels as NDJSON",
+    response_class=StreamingResponse,
+)
+async def export_emails(
+    api_key: SecretStr,
+    account_id: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    include_body: bool = False,
+    include_predictions: bool = False,
+):
+    """
+    One JSON object per line, ordered by (date_sent, id), emails without a date first.
+    Memory use is independent of the mailbox size, see app.db.export.iter_email_chunks.
+    include_predictions adds "predicted_label" from the saved TF-IDF model.
+    """
+    check_api_key(api_key)
+    model = None
+    if include_predictions:
+        try:
+            model = await asyncio.to_thread(load_model)
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="No trained model, run /admin/train") from e
+
+    chunks = iter_email_chunks(
+        with_body=include_body or include_predictions, account_id=account_id, since=since, until=until,
+    )
+    return StreamingResponse(_ndjson(chunks, include_body, model), media_type="application/x-ndjson")
@@ -15,9 +15,9 @@ id2label = None
 
 @router.post("/train")
 async def train():
-    emails = await fetch_labeled_emails()
-    label2id_local, id2label_local = build_label_vocab(emails)
-    texts, Y = prepare_training_data(emails, label2id_local)
+    texts, label_lists = await fetch_labeled_emails()
+    label2id_local, id2label_local = build_label_vocab(label_lists)
+    texts, Y = prepare_training_data(texts, label_lists, label2id_local)
 
     model, tokenizer = train_model(texts, Y, label2id_local, output_dir=MODEL_DIR)
 
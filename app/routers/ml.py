@@ -1,11 +1,19 @@
-from fastapi import APIRouter, Depends
+import asyncio
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from app.db.session import get_db
 
-from app.ml.training import load_training_data, train_model, evaluate_model, train_and_evaluate_roberta_svc
-from app.ml.persistence import save_model, load_model
+from app.ml.training import (
+    evaluate_model,
+    load_training_data,
+    train_and_evaluate_roberta_svc,
+    train_model,
+    train_model_from_db,
+)
+from app.ml.persistence import active_version, list_models, load_versioned_model, promote_model, save_model
 from app.ml.utils import split_data
-from app.ml.inference import load_inbox_emails, predict_labels
-from app.models.label import Label
+from app.ml.inference import load_predictions, score_new_emails
+from app.ml.online import online_model_status, publish_online_model, update_online_model
 import uuid
 
 router = APIRouter(prefix="/admin")
@@ -13,12 +21,10 @@ router = APIRouter(prefix="/admin")
 @router.post("/train-and-predict")
 async def train_and_predict(db=Depends(get_db)):
     """TF-IDF based single label: Train a model on existing labeled emails and predict labels for inbox emails."""
-    texts, labels = await load_training_data(db)
-    vectorizer, clf = train_model(texts, labels)
-    save_model(vectorizer, clf)
+    vectorizer, clf = await train_model_from_db(db)
+    version = await asyncio.to_thread(save_model, vectorizer, clf)
 
-    inbox_rows, inbox_texts = await load_inbox_emails(db)
-    predictions = predict_labels(vectorizer, clf, inbox_texts)
+    await score_new_emails(db, version, vectorizer, clf)
 
     # TODO: Remove as we don't want to store predicted labels yet
     # for email, label_name in zip(inbox_rows, predictions):
@@ -31,14 +37,48 @@ async def train_and_predict(db=Depends(get_db)):
     #     )
 
     # await db.commit()
-    return {"predicted": [{email.subject: label_name} for email, label_name in zip(inbox_rows, predictions)]}
+    # first page, further pages via GET /admin/predict
+    return await _prediction_page(db, version, limit=100)
 
 @router.post("/train")
 async def train_ml_model(db=Depends(get_db)):
-    texts, labels = await load_training_data(db)
-    vectorizer, clf = train_model(texts, labels)
-    save_model(vectorizer, clf)
-    return {"message": "Model trained successfully"}
+    vectorizer, clf = await train_model_from_db(db)
+    version = await asyncio.to_thread(save_model, vectorizer, clf)
+    return {"message": "Model trained successfully", "version": version}
+
+
+@router.get("/models", summary="List stored TF-IDF model versions")
+async def list_ml_models():
+    return {"active": active_version(), "versions": list_models()}
+
+
+@router.post("/models/{version}/promote", summary="Serve a stored TF-IDF model version")
+async def promote_ml_model(version: str):
+    try:
+        promote_model(version)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e)) from e
+    return {"active": version}
+
+
+@router.get("/online", summary="State of the online (HashingVectorizer + SGD) model")
+async def online_status():
+    return await online_model_status()
+
+
+@router.post("/online/update", summary="Learn label changes since the last online update and checkpoint")
+async def online_update(db=Depends(get_db)):
+    learned = await update_online_model(db, checkpoint=True)
+    return {"learned": learned, **await online_model_status()}
+
+
+@router.post("/online/publish", summary="Serve a snapshot of the online model")
+async def online_publish():
+    try:
+        version = await publish_online_model()
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e)) from e
+    return {"active": version}
 
 
 @router.post(
@@ -107,9 +147,35 @@ async def train_and_evaluate_roberta_endpoint(db=Depends(get_db)):
 
 
 
-@router.get("/predict")
-async def predict_ml_labels(db=Depends(get_db)):
-    vectorizer, clf = load_model()
-    inbox_rows, inbox_texts = await load_inbox_emails(db)
-    predictions = predict_labels(vectorizer, clf, inbox_texts)
-    return {"predicted": [{email.subject: label_name} for email, label_name in zip(inbox_rows, predictions)]}
\ No newline at end of file
+async def _prediction_page(db, version: str, limit: int, cursor: str | None = None):
+    predictions = await load_predictions(db, version, after=cursor, limit=limit)
+    return {
+        "model_version": version,
+        "predicted": [{subject: label_name} for _, subject, label_name in predictions],
+        "next_cursor": predictions[-1][0] if len(predictions) == limit else None,
+    }
+
+
+async def _active_model():
+    try:
+        return await asyncio.to_thread(load_versioned_model)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="No trained model, run /admin/train") from e
+
+
+@router.get("/predict", summary="Stored predictions of the active model for the inbox, paged by email id")
+async def predict_ml_labels(
+    limit: int = Query(default=100, ge=1, le=1000),
+    cursor: str | None = Query(default=None, description="next_cursor of the previous page"),
+    db=Depends(get_db),
+):
+    """Read only, POST /admin/predict scores the emails that have no prediction yet."""
+    version, _ = await _active_model()
+    return await _prediction_page(db, version, limit, cursor)
+
+
+@router.post("/predict", summary="Score inbox emails without a prediction of the active model")
+async def score_ml_labels(db=Depends(get_db)):
+    version, (vectorizer, clf) = await _active_model()
+    scored = await score_new_emails(db, version, vectorizer, clf)
+    return {"model_version": version, "scored": scored}
\ No newline at end of file
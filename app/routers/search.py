@@ -0,0 +1,92 @@
+import base64
+import binascii
+import json
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import exists, func, select, tuple_
+
+from app.db.search import search_query
+from app.db.session import get_db
+from app.models.email import Email
+from app.models.label import EmailLabel, LabelName
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/email", tags=["email", "search"])
+
+
+def _encode_cursor(rank: float, email_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([rank, email_id]).encode()).decode()
+
+
+def _decode_cursor(cursor: str):
+    try:
+        rank, email_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), str(email_id)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from e
+
+
+def _has_label(name: str):
+    label_id = select(LabelName.id).where(LabelName.name == name).scalar_subquery()
+    return exists().where(EmailLabel.email_id == Email.id).where(EmailLabel.label_id == label_id)
+
+
+@router.get("/search")
+async def search_emails(
+    q: str = Query(min_length=1, description='Web search syntax: words, "a phrase", -excluded, or'),
+    label: list[str] = Query(default=[], description="Only emails carrying all of these labels"),
+    account_id: str | None = None,
+    limit: int = Query(default=20, ge=1, le=100),
+    cursor: str | None = Query(default=None, description="next_cursor of the previous page"),
+    db=Depends(get_db),
+):
+    """
+    Full-text search over subject and body, best matches first.
+    Pages are keyset-paginated on (rank, id) without OFFSET, so they stay stable while paging.
+    """
+    query = search_query(q)
+    rank = func.ts_rank_cd(Email.search_vector, query)
+
+    stmt = (
+        select(Email.id, Email.account_id, Email.subject, Email.from_address, Email.date_sent, rank.label("rank"))
+        .where(Email.search_vector.op("@@")(query))
+        .order_by(rank.desc(), Email.id.desc())
+        .limit(limit + 1)
+    )
+    for name in label:
+        stmt = stmt.where(_has_label(name))
+    if account_id is not None:
+        stmt = stmt.where(Email.account_id == account_id)
+    if cursor is not None:
+        stmt = stmt.where(tuple_(rank, Email.id) < tuple_(*_decode_cursor(cursor)))
+
+    rows = (await db.execute(stmt)).all()
+    page, more = rows[:limit], len(rows) > limit
+
+    labels = {}
+    if page:
+        result = await db.execute(
+            select(EmailLabel.email_id, LabelName.name)
+            .join(LabelName, LabelName.id == EmailLabel.label_id)
+            .where(EmailLabel.email_id.in_([r.id for r in page]))
+        )
+        for email_id, name in result.all():
+            labels.setdefault(email_id, []).append(name)
+
+    return {
+        "results": [
+            {
+                "id": r.id,
+                "account_id": r.account_id,
+                "subject": r.subject,
+                "from_address": r.from_address,
+                "date_sent": r.date_sent,
+                "labels": sorted(labels.get(r.id, [])),
+                "rank": r.rank,
+            }
+            for r in page
+        ],
+        "next_cursor": _encode_cursor(page[-1].rank, page[-1].id) if more else None,
+    }
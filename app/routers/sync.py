@@ -1,7 +1,12 @@
-from fastapi import APIRouter, BackgroundTasks, HTTPException
+from fastapi import APIRouter, BackgroundTasks, HTTPException, status
+from pydantic import BaseModel
+import binascii
 import logging
+import secrets
 
-from app.gmail.sync import sync_gmail
+from app.config import DEFAULT_GMAIL_ACCOUNT, GMAIL_ACCOUNTS
+from app.gmail.push import GMAIL_PUSH_TOKEN, account_for_address, decode_push_data, get_sync_trigger
+from app.gmail.sync import is_stalled, sync_gmail
 from app.db.session import AsyncSessionLocal
 from app.models.sync_state import SyncState
 from sqlalchemy import select
@@ -11,13 +16,30 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/email/sync", tags=["email", "sync"])
 
 
+class PubSubMessage(BaseModel):
+    data: str
+    messageId: str | None = None
+    publishTime: str | None = None
+
+
+class PushEnvelope(BaseModel):
+    message: PubSubMessage
+    subscription: str | None = None
+
+
+def _check_account(account_id: str):
+    if account_id not in GMAIL_ACCOUNTS:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown account {account_id!r}")
+
+
 @router.post("/run")
-def sync_emails(background_tasks: BackgroundTasks):
+def sync_emails(background_tasks: BackgroundTasks, account_id: str = DEFAULT_GMAIL_ACCOUNT):
     """
-    Trigger Gmail sync as a background task.
+    Trigger Gmail sync of an account as a background task.
     """
+    _check_account(account_id)
     try:
-        background_tasks.add_task(sync_gmail)
+        background_tasks.add_task(sync_gmail, account_id)
         logger.info(
             "Gmail sync task started in background",
             extra={"background_tasks": background_tasks},
@@ -28,21 +50,84 @@ def sync_emails(background_tasks: BackgroundTasks):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/backfill")
+def backfill_emails(background_tasks: BackgroundTasks, account_id: str = DEFAULT_GMAIL_ACCOUNT):
+    """
+    Trigger a sync whose full sync runs as parallel, date-partitioned backfill.
+    Only has an effect if a full sync is due (no history id yet, or it expired).
+    """
+    _check_account(account_id)
+    background_tasks.add_task(sync_gmail, account_id, backfill=True)
+    logger.info("Gmail backfill task started in background")
+    return {"status": "backfill started"}
+
+
+@router.post("/push", status_code=status.HTTP_204_NO_CONTENT)
+async def push_notification(envelope: PushEnvelope, token: str | None = None) -> None:
+    """
+    Receive a Gmail watch notification delivered by Pub/Sub push.
+    Notifications are debounced into one incremental sync up to the pushed historyId.
+
+    Refused unless GMAIL_PUSH_TOKEN is configured and passed as ?token=.
+
+    Local stand-in for testing: POST {"message": {"data": base64('{"historyId": 123}')}}.
+    """
+    if not GMAIL_PUSH_TOKEN:
+        # fail closed, without a token anyone could trigger syncs
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Push is not configured")
+    if token is None or not secrets.compare_digest(token.encode(), GMAIL_PUSH_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid push token")
+
+    try:
+        data = decode_push_data(envelope.message.data)
+    except (binascii.Error, ValueError) as e:
+        # acknowledge anyway, Pub/Sub would redeliver a malformed message forever
+        logger.warning("Ignoring malformed push notification: %s", e)
+        return
+
+    account_id = await account_for_address(data.get("emailAddress"))
+    if account_id is None:
+        logger.warning("Ignoring push notification for unknown address=%r", data.get("emailAddress"))
+        return
+
+    logger.debug("Push notification account=%s history_id=%s", account_id, data.get("historyId"))
+    get_sync_trigger(account_id).notify(data.get("historyId"))
+
+
+def _state_status(state: SyncState | None):
+    if not state:
+        return {"running": False, "stalled": False, "processed_messages": 0, "last_error": None}
+    return {
+        "email_address": state.email_address,
+        "running": state.running,
+        "stalled": is_stalled(state),
+        "heartbeat_at": state.heartbeat_at,
+        "processed_messages": state.processed_messages,
+        "last_error": state.last_error,
+        "last_started_at": state.last_started_at,
+        "last_finished_at": state.last_finished_at,
+        "history_id": state.history_id,
+        "full_sync_in_progress": state.full_sync_history_id is not None,
+        "full_sync_listed": state.full_sync_listed,
+    }
+
+
 @router.get("/status", tags=["sync","status"])
-async def sync_status():
+async def sync_status(account_id: str = DEFAULT_GMAIL_ACCOUNT):
+    """
+    Check current sync state of an account.
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(SyncState).where(SyncState.id == account_id))
+        return _state_status(result.scalar_one_or_none())
+
+
+@router.get("/accounts", tags=["sync","status"])
+async def sync_accounts():
     """
-    Check current sync state.
+    Sync state of every configured account.
     """
     async with AsyncSessionLocal() as db:
-        result = await db.execute(select(SyncState).where(SyncState.id == "gmail"))
-        state = result.scalar_one_or_none()
-        if not state:
-            return {"running": False, "processed_messages": 0, "last_error": None}
-        return {
-            "running": state.running,
-            "processed_messages": state.processed_messages,
-            "last_error": state.last_error,
-            "last_started_at": state.last_started_at,
-            "last_finished_at": state.last_finished_at,
-            "history_id": state.history_id,
-        }
+        result = await db.execute(select(SyncState).where(SyncState.id.in_(GMAIL_ACCOUNTS)))
+        states = {state.id: state for state in result.scalars().all()}
+    return {account_id: _state_status(states.get(account_id)) for account_id in GMAIL_ACCOUNTS}
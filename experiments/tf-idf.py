@@ -1,6 +1,8 @@
 from sqlalchemy import select, func
 from app.models.email import Email
-from app.models.label import Label
+from app.models.email_body import EmailBody
+from app.models.label import EmailLabel, LabelName
+from app.db.bodies import decompress_body
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.svm import LinearSVC
 import numpy as np
@@ -12,17 +14,19 @@ stmt = (
     select(
         Email.id,
         Email.subject,
-        Email.body,
-        Label.name.label("label"),
+        EmailBody.data.label("body"),
+        LabelName.name.label("label"),
     )
-    .join(Label)
-    .where(Label.name.in_(SEMANTIC_LABELS))
+    .join(EmailLabel, EmailLabel.email_id == Email.id)
+    .join(LabelName, LabelName.id == EmailLabel.label_id)
+    .outerjoin(EmailBody, Email.body_hash == EmailBody.hash)
+    .where(LabelName.name.in_(SEMANTIC_LABELS))
 )
 
 rows = (await db.execute(stmt)).all()
 
 texts = [
-    f"{r.subject or ''}\n{r.body or ''}"
+    f"{r.subject or ''}\n{decompress_body(r.body) or ''}"
     for r in rows
 ]
 
@@ -49,15 +53,17 @@ X = vectorizer.fit_transform(texts)
 clf.fit(X, y)
 
 stmt = (
-    select(Email.id, Email.subject, Email.body)
-    .join(Label)
-    .where(Label.name == "INBOX")
+    select(Email.id, Email.subject, EmailBody.data.label("body"))
+    .join(EmailLabel, EmailLabel.email_id == Email.id)
+    .join(LabelName, LabelName.id == EmailLabel.label_id)
+    .outerjoin(EmailBody, Email.body_hash == EmailBody.hash)
+    .where(LabelName.name == "INBOX")
 )
 
 inbox_rows = (await db.execute(stmt)).all()
 
 texts_inbox = [
-    f"{r.subject or ''}\n{r.body or ''}"
+    f"{r.subject or ''}\n{decompress_body(r.body) or ''}"
     for r in inbox_rows
 ]
 X_inbox = vectorizer.transform(texts_inbox)
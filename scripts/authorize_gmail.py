@@ -0,0 +1,24 @@
+import argparse
+import logging
+
+from app.config import DEFAULT_GMAIL_ACCOUNT
+from app.gmail.client import GmailClient
+
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    """
+    Run the OAuth flow for an account once, so the worker finds its token.
+    """
+    parser = argparse.ArgumentParser(description="Authorize Gmail access for an account of GMAIL_ACCOUNTS")
+    parser.add_argument("account_id", nargs="?", default=DEFAULT_GMAIL_ACCOUNT)
+    args = parser.parse_args()
+
+    client = GmailClient(account_id=args.account_id)
+    profile = client.get_profile()
+    logger.info("✅ Authorized account=%s address=%s token=%s", args.account_id, profile["emailAddress"], client.token_file)
+
+
+if __name__ == "__main__":
+    main()
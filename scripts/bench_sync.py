@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from sqlalchemy import delete, event, select
+
+from app.db.session import AsyncSessionLocal, engine
+from app.db.utils import commit_or_rollback
+from app.gmail.executor import set_client_factory, shutdown_gmail_executor
+from app.gmail.fake import MIME_STRUCTURES, FakeGmailClient, FakeMailbox, FakeStats
+from app.gmail.history import prune_orphan_bodies
+from app.gmail.ratelimit import get_bucket
+from app.gmail.sync import sync_gmail
+from app.models.backfill_window import BackfillWindow
+from app.models.email import Email
+from app.models.sync_state import SyncState
+
+logger = logging.getLogger(__name__)
+
+# Runs a full and an incremental sync against the in-process fake Gmail API and
+# reports throughput, API calls and DB statements per message. Writes into the
+# configured database under its own account id, whose rows are replaced on every run:
+#
+#   python -m scripts.bench_sync --messages 5000 --latency 0.05 --error-rate 0.01
+
+
+class StatementCounter:
+    """
+    Counts statements sent through SQLAlchemy. COPY loads of app.db.bulk go
+    through the raw asyncpg connection and are not included.
+    """
+
+    def __init__(self):
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+async def clear_account(account_id: str):
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(delete(Email).where(Email.account_id == account_id).returning(Email.body_hash))
+        await prune_orphan_bodies(db, result.scalars().all())
+        await db.execute(delete(BackfillWindow).where(BackfillWindow.sync_state_id == account_id))
+        await db.execute(delete(SyncState).where(SyncState.id == account_id))
+        await commit_or_rollback(db, context={"sync_state_id": account_id, "action": "bench_clear"})
+
+
+async def processed_messages(account_id: str) -> int:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(SyncState.processed_messages).where(SyncState.id == account_id))
+        return result.scalar_one_or_none() or 0
+
+
+async def run_phase(name: str, account_id: str, messages: int, stats: FakeStats, statements: StatementCounter, **kwargs):
+    """
+    Run one sync and measure it.
+
+    :param messages: messages the phase has to handle, the denominator of the per message figures
+    """
+    stats.reset()
+    statements.count = 0
+    started = time.perf_counter()
+    # only the sync is measured, learning and scoring would time the models instead
+    # and write checkpoints to models/online
+    await sync_gmail(account_id, predict=False, learn=False, **kwargs)
+    seconds = time.perf_counter() - started
+
+    per_message = max(messages, 1)
+    return {
+        "phase": name,
+        "messages": messages,
+        "written": await processed_messages(account_id),
+        "seconds": round(seconds, 3),
+        "messages_per_second": round(messages / seconds, 1) if seconds else None,
+        "http_calls": sum(stats.http_calls.values()),
+        "api_requests": sum(stats.requests.values()),
+        "http_calls_per_message": round(sum(stats.http_calls.values()) / per_message, 3),
+        "api_requests_per_message": round(sum(stats.requests.values()) / per_message, 3),
+        "db_statements": statements.count,
+        "db_statements_per_message": round(statements.count / per_message, 3),
+        "injected_errors": dict(stats.errors),
+        "requests_by_method": dict(stats.requests),
+    }
+
+
+def print_report(results):
+    columns = [
+        ("phase", "phase"),
+        ("messages", "msgs"),
+        ("seconds", "secs"),
+        ("messages_per_second", "msg/s"),
+        ("http_calls_per_message", "http/msg"),
+        ("api_requests_per_message", "api/msg"),
+        ("db_statements_per_message", "stmt/msg"),
+    ]
+    print(" ".join(f"{title:>12}" for _, title in columns))
+    for result in results:
+        print(" ".join(f"{str(result[key]):>12}" for key, _ in columns))
+    for result in results:
+        print(f"{result['phase']}: requests={result['requests_by_method']} errors={result['injected_errors']}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark Gmail sync against a fake Gmail API")
+    parser.add_argument("--account", default="bench", help="account id the benchmark writes under")
+    parser.add_argument("--messages", type=int, default=2000, help="mailbox size for the full sync")
+    parser.add_argument("--structure", default="alternative", choices=MIME_STRUCTURES + ("random",))
+    parser.add_argument("--body-chars", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per Gmail HTTP round trip")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls failing with 429/503")
+    parser.add_argument("--quota", type=float, default=None,
+                        help="quota units per second, default GMAIL_QUOTA_UNITS_PER_SECOND, 0 for unlimited")
+    parser.add_argument("--added", type=int, default=100, help="new messages for the incremental sync")
+    parser.add_argument("--deleted", type=int, default=20)
+    parser.add_argument("--relabeled", type=int, default=50)
+    parser.add_argument("--backfill", action="store_true", help="run the full sync as date-partitioned backfill")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    mailbox = FakeMailbox(size=args.messages, structure=args.structure, body_chars=args.body_chars)
+    stats = FakeStats()
+    set_client_factory(lambda account_id: FakeGmailClient(
+        mailbox, account_id=account_id, stats=stats, latency=args.latency, error_rate=args.error_rate,
+    ))
+    if args.quota is not None:
+        bucket = get_bucket(args.account)
+        bucket.rate = bucket.capacity = bucket.tokens = args.quota or 1e12
+
+    statements = StatementCounter()
+    await clear_account(args.account)
+
+    results = [await run_phase(
+        "full", args.account, args.messages, stats, statements, backfill=args.backfill,
+    )]
+
+    mailbox.add(args.added)
+    mailbox.delete(args.deleted)
+    mailbox.relabel(args.relabeled)
+    results.append(await run_phase(
+        "incremental", args.account, args.added + args.deleted + args.relabeled, stats, statements,
+    ))
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    shutdown_gmail_executor()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
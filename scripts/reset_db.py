@@ -11,7 +11,7 @@ async def main() -> None:
         async with session.begin():
             await reset_email_tables(session)
 
-    logger.info("✅ Database reset: sync_state, labels, emails")
+    logger.info("✅ Database reset: sync_state, email_labels, emails")
 
 
 if __name__ == "__main__":